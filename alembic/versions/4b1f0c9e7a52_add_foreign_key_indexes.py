@@ -0,0 +1,36 @@
+"""add foreign key indexes
+
+Revision ID: 4b1f0c9e7a52
+Revises: e0fae724db09
+Create Date: 2026-10-17 11:03:18.204517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b1f0c9e7a52'
+down_revision: Union[str, None] = 'e0fae724db09'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # batteryPack.name, steps (batteryPack_id, number) and the step_id of sub_steps,
+    # pictures and tools are already indexed by the unique constraints of e0fae724db09
+    op.create_index(op.f('ix_timers_step_id'), 'timers', ['step_id'], unique=False)
+    op.create_index(op.f('ix_timers_disassembly_id'), 'timers', ['disassembly_id'], unique=False)
+    op.create_index(op.f('ix_comments_step_id'), 'comments', ['step_id'], unique=False)
+    op.create_index(op.f('ix_disassemblies_batteryPack_id'), 'disassemblies', ['batteryPack_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_disassemblies_batteryPack_id'), table_name='disassemblies')
+    op.drop_index(op.f('ix_comments_step_id'), table_name='comments')
+    op.drop_index(op.f('ix_timers_disassembly_id'), table_name='timers')
+    op.drop_index(op.f('ix_timers_step_id'), table_name='timers')
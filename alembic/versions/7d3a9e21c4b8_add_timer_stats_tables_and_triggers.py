@@ -0,0 +1,146 @@
+"""add timer stats tables and triggers
+
+Revision ID: 7d3a9e21c4b8
+Revises: 4b1f0c9e7a52
+Create Date: 2026-10-17 13:47:05.913826
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d3a9e21c4b8'
+down_revision: Union[str, None] = '4b1f0c9e7a52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TIMER_STATS_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION refresh_step_timer_stats(step_ids uuid[]) RETURNS void AS $$
+    BEGIN
+        DELETE FROM step_timer_stats st
+        WHERE st.step_id = ANY(step_ids)
+          AND NOT EXISTS (SELECT 1 FROM timers t WHERE t.step_id = st.step_id);
+
+        INSERT INTO step_timer_stats (step_id, "batteryPack_id", count, mean, p50, p90, updated_at)
+        SELECT t.step_id, s."batteryPack_id", count(*), avg(t.length),
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY t.length),
+               percentile_cont(0.9) WITHIN GROUP (ORDER BY t.length),
+               now()
+        FROM timers t JOIN steps s ON s.id = t.step_id
+        WHERE t.step_id = ANY(step_ids)
+        GROUP BY t.step_id, s."batteryPack_id"
+        ON CONFLICT (step_id) DO UPDATE SET
+            count = EXCLUDED.count, mean = EXCLUDED.mean, p50 = EXCLUDED.p50,
+            p90 = EXCLUDED.p90, updated_at = EXCLUDED.updated_at;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION refresh_pack_timer_stats(pack_ids uuid[]) RETURNS void AS $$
+    BEGIN
+        INSERT INTO pack_timer_stats ("batteryPack_id", estimated_time, measured_time, disassembly_count,
+                                      mean_total_time, p50_total_time, p90_total_time, updated_at)
+        SELECT bp.id,
+               (SELECT sum(s.time) FROM steps s WHERE s."batteryPack_id" = bp.id),
+               (SELECT sum(st.mean) FROM step_timer_stats st WHERE st."batteryPack_id" = bp.id),
+               d.n, d.mean, d.p50, d.p90, now()
+        FROM "batteryPack" bp
+        CROSS JOIN LATERAL (
+            SELECT count(*) AS n, avg(total_time) AS mean,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY total_time) AS p50,
+                   percentile_cont(0.9) WITHIN GROUP (ORDER BY total_time) AS p90
+            FROM disassemblies WHERE "batteryPack_id" = bp.id
+        ) d
+        WHERE bp.id = ANY(pack_ids)
+        ON CONFLICT ("batteryPack_id") DO UPDATE SET
+            estimated_time = EXCLUDED.estimated_time, measured_time = EXCLUDED.measured_time,
+            disassembly_count = EXCLUDED.disassembly_count, mean_total_time = EXCLUDED.mean_total_time,
+            p50_total_time = EXCLUDED.p50_total_time, p90_total_time = EXCLUDED.p90_total_time,
+            updated_at = EXCLUDED.updated_at;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION timers_refresh_stats() RETURNS trigger AS $$
+    BEGIN
+        PERFORM refresh_step_timer_stats(ARRAY(SELECT DISTINCT step_id FROM new_timers));
+        PERFORM refresh_pack_timer_stats(ARRAY(
+            SELECT DISTINCT s."batteryPack_id" FROM new_timers n JOIN steps s ON s.id = n.step_id
+        ));
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION disassemblies_refresh_stats() RETURNS trigger AS $$
+    BEGIN
+        PERFORM refresh_pack_timer_stats(ARRAY(SELECT DISTINCT "batteryPack_id" FROM new_disassemblies));
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS timers_refresh_stats ON timers",
+    """
+    CREATE TRIGGER timers_refresh_stats AFTER INSERT ON timers
+    REFERENCING NEW TABLE AS new_timers
+    FOR EACH STATEMENT EXECUTE FUNCTION timers_refresh_stats()
+    """,
+    "DROP TRIGGER IF EXISTS disassemblies_refresh_stats ON disassemblies",
+    """
+    CREATE TRIGGER disassemblies_refresh_stats AFTER INSERT ON disassemblies
+    REFERENCING NEW TABLE AS new_disassemblies
+    FOR EACH STATEMENT EXECUTE FUNCTION disassemblies_refresh_stats()
+    """,
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('step_timer_stats',
+    sa.Column('step_id', sa.UUID(), nullable=False),
+    sa.Column('batteryPack_id', sa.UUID(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('mean', sa.Float(), nullable=True),
+    sa.Column('p50', sa.Float(), nullable=True),
+    sa.Column('p90', sa.Float(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['batteryPack_id'], ['batteryPack.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['step_id'], ['steps.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('step_id')
+    )
+    op.create_index(op.f('ix_step_timer_stats_batteryPack_id'), 'step_timer_stats', ['batteryPack_id'], unique=False)
+    op.create_table('pack_timer_stats',
+    sa.Column('batteryPack_id', sa.UUID(), nullable=False),
+    sa.Column('estimated_time', sa.Float(), nullable=True),
+    sa.Column('measured_time', sa.Float(), nullable=True),
+    sa.Column('disassembly_count', sa.Integer(), nullable=False),
+    sa.Column('mean_total_time', sa.Float(), nullable=True),
+    sa.Column('p50_total_time', sa.Float(), nullable=True),
+    sa.Column('p90_total_time', sa.Float(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['batteryPack_id'], ['batteryPack.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('batteryPack_id')
+    )
+    for statement in TIMER_STATS_DDL:
+        op.execute(statement)
+    # backfill with the timers already recorded
+    op.execute("SELECT refresh_step_timer_stats(ARRAY(SELECT id FROM steps))")
+    op.execute('SELECT refresh_pack_timer_stats(ARRAY(SELECT id FROM "batteryPack"))')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS disassemblies_refresh_stats ON disassemblies")
+    op.execute("DROP TRIGGER IF EXISTS timers_refresh_stats ON timers")
+    op.execute("DROP FUNCTION IF EXISTS disassemblies_refresh_stats()")
+    op.execute("DROP FUNCTION IF EXISTS timers_refresh_stats()")
+    op.execute("DROP FUNCTION IF EXISTS refresh_pack_timer_stats(uuid[])")
+    op.execute("DROP FUNCTION IF EXISTS refresh_step_timer_stats(uuid[])")
+    op.drop_table('pack_timer_stats')
+    op.drop_index(op.f('ix_step_timer_stats_batteryPack_id'), table_name='step_timer_stats')
+    op.drop_table('step_timer_stats')
@@ -0,0 +1,87 @@
+"""add natural key unique constraints
+
+Revision ID: e0fae724db09
+Revises: 96d26b15a881
+Create Date: 2026-10-17 10:12:41.532190
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e0fae724db09'
+down_revision: Union[str, None] = '96d26b15a881'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _table(name, *columns):
+    return sa.table(name, *(sa.column(c) for c in columns))
+
+
+def _merge_duplicates(conn, table, keys, children=()):
+    """
+    Keep one row per natural key (the smallest id) : the foreign keys of the duplicates
+    are moved to the kept row, then the duplicates are deleted.
+    children : [(table, foreign key column), ...] pointing to table.id
+    """
+    groups = {}
+    for row in conn.execute(sa.select(table.c.id, *(table.c[k] for k in keys))):
+        groups.setdefault(tuple(row[1:]), []).append(row[0])
+
+    moves = []
+    for ids in groups.values():
+        keep, *duplicates = sorted(ids, key=str)
+        moves.extend({"duplicate": d, "keep": keep} for d in duplicates)
+    if not moves:
+        return
+
+    for child, fk in children:
+        conn.execute(
+            child.update().where(child.c[fk] == sa.bindparam("duplicate")).values({fk: sa.bindparam("keep")}),
+            moves,
+        )
+    duplicate_ids = [m["duplicate"] for m in moves]
+    for start in range(0, len(duplicate_ids), 1000):
+        conn.execute(table.delete().where(table.c.id.in_(duplicate_ids[start:start + 1000])))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # merge the packs / steps / children duplicated by previous runs, parents first :
+    # the children of merged parents may become duplicates themselves
+    conn = op.get_bind()
+    packs = _table('batteryPack', 'id', 'name')
+    steps = _table('steps', 'id', 'batteryPack_id', 'number')
+    sub_steps = _table('sub_steps', 'id', 'step_id', 'number')
+    pictures = _table('pictures', 'id', 'step_id', 'link')
+    tools = _table('tools', 'id', 'step_id', 'name')
+    disassemblies = _table('disassemblies', 'id', 'batteryPack_id')
+    timers = _table('timers', 'id', 'step_id')
+    comments = _table('comments', 'id', 'step_id')
+
+    _merge_duplicates(conn, packs, ['name'], [(steps, 'batteryPack_id'), (disassemblies, 'batteryPack_id')])
+    _merge_duplicates(conn, steps, ['batteryPack_id', 'number'], [
+        (sub_steps, 'step_id'), (pictures, 'step_id'), (tools, 'step_id'), (timers, 'step_id'), (comments, 'step_id'),
+    ])
+    _merge_duplicates(conn, sub_steps, ['step_id', 'number'])
+    _merge_duplicates(conn, pictures, ['step_id', 'link'])
+    _merge_duplicates(conn, tools, ['step_id', 'name'])
+
+    op.create_unique_constraint('batteryPack_name_key', 'batteryPack', ['name'])
+    op.create_unique_constraint('uq_steps_batteryPack_id_number', 'steps', ['batteryPack_id', 'number'])
+    op.create_unique_constraint('uq_sub_steps_step_id_number', 'sub_steps', ['step_id', 'number'])
+    op.create_unique_constraint('uq_pictures_step_id_link', 'pictures', ['step_id', 'link'])
+    op.create_unique_constraint('uq_tools_step_id_name', 'tools', ['step_id', 'name'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_tools_step_id_name', 'tools', type_='unique')
+    op.drop_constraint('uq_pictures_step_id_link', 'pictures', type_='unique')
+    op.drop_constraint('uq_sub_steps_step_id_number', 'sub_steps', type_='unique')
+    op.drop_constraint('uq_steps_batteryPack_id_number', 'steps', type_='unique')
+    op.drop_constraint('batteryPack_name_key', 'batteryPack', type_='unique')
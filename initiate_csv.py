@@ -60,6 +60,38 @@ Question: {question}
 
 prompt = PromptTemplate.from_template(template)
 
+# ------------------------- FREE TEXT PROMPT TEMPLATE -------------------------
+# hybrid mode : name, number, time and tools are read from the CSV columns,
+# the LLM only handles the sub-steps and the risks
+free_text_template = """Respond **only** with a valid JSON respecting exactly this format:
+{{
+  "rows": [
+    {{
+      "row": <value of the Row column>,
+      "risks": "<risks as key words >",
+      "sub_steps": [
+        {{
+          "name": "<name of the sub-step>",
+          "number": <number>
+        }}
+        {{… repeat as many as you find …}}
+      ]
+    }}
+    {{… repeat for every row …}}
+  ]
+}}
+
+
+Context from the battery pack disassembly: {context}
+Question: {question}
+
+
+— Do not include any comments, trailing commas, or ellipses (`…`) in the JSON.
+— **If a field is missing, use `null`.**
+"""
+
+free_text_prompt = PromptTemplate.from_template(free_text_template)
+
 # --------------------------- INIT DB ---------------------------
 if __name__ == "__main__":
 
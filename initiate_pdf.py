@@ -1,12 +1,18 @@
 import os
+import argparse
+from functools import partial
 os.environ["USER_AGENT"] = "MonScript/1.0 (+https://github.com/eigsi)"
-from langchain_community.document_loaders import DirectoryLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
 from langchain_chroma import Chroma
 from langchain_core.prompts import PromptTemplate
-from glob import glob
-from utils.images import extract_main_image, extract_step_images, _extract_images_from_page
+from langchain_core.documents import Document
+import uuid
+from utils.images import parse_pdf_document
+from utils.embeddings import get_embeddings, embed_in_batches
+from utils.manifest import list_pdfs, load_manifest, save_manifest, diff_manifest
+from utils.parallel import map_pdfs
+from utils.splitter import split_by_steps
+from utils.results import append_result
+from utils.ann_store import LocalANNStore
 from models import init_db
 from dotenv import load_dotenv
 
@@ -21,22 +27,68 @@ os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
 LLM_NAME = "gpt-4.1"
 DOCS_PATH = "docs/"
 PERSIST_DIR = "./chroma_langchain_db"
+MANIFEST_PATH = os.path.join(PERSIST_DIR, "manifest.json")
 
-# ---------------------------- LOAD & SPLIT DOCS ----------------------------
-def load_and_split_documents(path, glob="**/*.pdf", chunk_size=1000, chunk_overlap=250):
-    loader = DirectoryLoader(path, glob=glob)
-    docs = loader.load()
-    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    return splitter.split_documents(docs)
+# -------------------------------- SPLIT DOCS --------------------------------
+def split_pdf_text(pdf_path, page_texts, max_chunk_size=2000, chunk_overlap=100):
+    """
+    Split the text of a PDF already read by parse_pdf_document (no second opening of the file)
+    One chunk per "Step N:" / "Section N:", size-based splitting only for oversized steps
+    """
+    docs = [Document(page_content="\n\n".join(page_texts), metadata={"source": pdf_path})]
+    return split_by_steps(docs, max_chunk_size=max_chunk_size, chunk_overlap=chunk_overlap)
+
+# ------------------------------ PARSE ONE PDF ------------------------------
+def parse_pdf(pdf_file, keep_original=False, max_dimension=None):
+    """
+    Everything done on a single PDF before embedding : images + text chunks,
+    from a single pass over the document.
+    Run in the worker processes when --workers > 1
+    """
+    parsed = parse_pdf_document(pdf_file, keep_original=keep_original, max_dimension=max_dimension)
+    docs = split_pdf_text(pdf_file, parsed["page_texts"])
+    for doc in docs:
+        doc.metadata["main_image"] = parsed["main_image"]
+    return {"docs": docs, "main_image": parsed["main_image"], "step_images": parsed["step_images"]}
 
 # --------------------------- CREATE VECTOR STORE ---------------------------
-def create_vector_store(persist_directory):
+def create_vector_store(persist_directory, backend=None, embedding_provider=None):
+    """
+    backend            : "chroma" (default) or "ann", the in-process HNSW index stored in persist_directory/ann
+    embedding_provider : "openai" (default) or "local", see get_embeddings
+    Read from VECTOR_BACKEND / EMBEDDING_PROVIDER when not given.
+    Each provider has its own collection, their vectors do not have the same size.
+    """
+    backend = backend or os.getenv("VECTOR_BACKEND", "chroma")
+    embedding_provider = embedding_provider or os.getenv("EMBEDDING_PROVIDER", "openai")
+    embeddings = get_embeddings(provider=embedding_provider)
+    suffix = "" if embedding_provider == "openai" else f"_{embedding_provider}"
+    if backend == "ann":
+        return LocalANNStore(embedding_function=embeddings, persist_directory=os.path.join(persist_directory, f"ann{suffix}"))
+    if backend != "chroma":
+        raise ValueError(f"unknown vector backend : {backend}")
     client = Chroma(
-        embedding_function=OpenAIEmbeddings(),
+        collection_name=f"langchain{suffix}",
+        embedding_function=embeddings,
         persist_directory=persist_directory
     )
     return client
 
+# ------------------------- PURGE OLD CHAT RESPONSES -------------------------
+def purge_chat_responses(vector_store):
+    """
+    Move the answers older versions of main_pdf.py wrote into the vector store
+    (metadata source "chat_response") to the results file, then delete them.
+    They keep "chat_response" as source, apart from the answers of the whole-store runs (source None).
+    Return the number of entries removed.
+    """
+    old = vector_store.get(where={"source": "chat_response"}, include=["documents"])
+    for answer_text in old["documents"]:
+        append_result(answer_text, source="chat_response")
+    if old["ids"]:
+        vector_store.delete(ids=old["ids"])
+    return len(old["ids"])
+
 # ----------------------------- PROMPT TEMPLATE -----------------------------
 template = """Respond **only** with a valid JSON respecting exactly this format:
 {{
@@ -96,23 +148,118 @@ The result for each step must look like:
 
 prompt = PromptTemplate.from_template(template)
 
+# per-step mode : one call per "Step N" section, the pictures are added afterwards
+step_template = """Respond **only** with a valid JSON respecting exactly this format:
+{{
+  "name": "<name of the step>",
+  "number": <number>,
+  "time": <duration as float>,
+  "risks": "<risks as key words >",
+  "sub_steps": [
+    {{
+      "name": "<name of the sub-step>",
+      "number": <number>
+    }}
+    {{… repeat as many as you find …}}
+  ],
+  "tools": [
+    {{
+      "name": "<name of the tool>"
+    }}
+    {{… repeat as many as you find …}}
+  ]
+}}
+
+
+Context from the battery pack disassembly: {context}
+Question: {question}
+
+— Do not include any comments, trailing commas, or ellipses (`…`) in the JSON.
+"""
+
+step_prompt = PromptTemplate.from_template(step_template)
+
+pack_template = """Respond **only** with a valid JSON respecting exactly this format:
+{{
+  "name": "<name of the pack>"
+}}
+
+
+Context from the battery pack disassembly: {context}
+Question: {question}
+"""
+
+pack_prompt = PromptTemplate.from_template(pack_template)
+
 # --------------------------- SET UP VECTOR STORE ---------------------------
 if __name__ == "__main__":
-    # EXTRACT MAIN IMAGE
-    main_images = {
-      pdf_file: extract_main_image(pdf_file)
-      for pdf_file in glob(f"{DOCS_PATH}/**/*.pdf", recursive=True)
-    }
-
-    docs = load_and_split_documents(DOCS_PATH)
-    
-    for doc in docs:
-      src = doc.metadata["source"]
-      doc.metadata["main_image"] = main_images.get(src, "")
-      
+    parser = argparse.ArgumentParser(description="Index the PDFs of docs/ into the vector store")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes parsing the PDFs")
+    parser.add_argument("--keep-original-images", action="store_true", help="write JPEG/PNG image streams as-is instead of re-encoding them to PNG")
+    parser.add_argument("--max-image-size", type=int, default=None, help="downscale images so their largest side fits in this many pixels")
+    parser.add_argument("--embed-batch-tokens", type=int, default=100_000, help="max (estimated) tokens per embedding request")
+    parser.add_argument("--embed-concurrency", type=int, default=4, help="number of embedding requests running at the same time")
+    parser.add_argument("--purge-chat-responses", action="store_true", help="move the answers stored in the vector store by older runs of main_pdf.py to the results file")
+    args = parser.parse_args()
+
+    manifest = load_manifest(MANIFEST_PATH)
+    changes = diff_manifest(manifest, list_pdfs(DOCS_PATH))
     vector_store = create_vector_store(PERSIST_DIR)
-    vector_store.add_documents(docs)
+
+    # chunks missing from the store (other VECTOR_BACKEND, store deleted) : index the PDF again
+    for pdf in list(changes["unchanged"]):
+      if manifest[pdf]["chunk_ids"] and not vector_store.get_by_ids(manifest[pdf]["chunk_ids"][:1]):
+        changes["unchanged"].remove(pdf)
+        changes["modified"][pdf] = {key: manifest[pdf][key] for key in ("sha256", "mtime", "size")}
+
+    print(f"📄 {len(changes['new'])} nouveau(x), {len(changes['modified'])} modifié(s), "
+          f"{len(changes['deleted'])} supprimé(s), {len(changes['unchanged'])} inchangé(s)")
+
+    if args.purge_chat_responses:
+      print(f"🧹 {purge_chat_responses(vector_store)} réponse(s) retirée(s) du vector store")
+
+    # REMOVE CHUNKS OF MODIFIED & DELETED PDFS
+    stale_ids = [
+      chunk_id
+      for pdf in [*changes["modified"], *changes["deleted"]]
+      for chunk_id in manifest[pdf]["chunk_ids"]
+    ]
+    # a PDF without manifest entry may still have chunks from the runs before the manifest (DirectoryLoader)
+    for pdf in changes["new"]:
+      stale_ids.extend(vector_store.get(where={"source": pdf}, include=[])["ids"])
+    if stale_ids:
+      vector_store.delete(ids=stale_ids)
+    for pdf in changes["deleted"]:
+      del manifest[pdf]
+    save_manifest(manifest, MANIFEST_PATH)
+
+    # PARSE NEW OR MODIFIED PDFS IN PARALLEL
+    to_index = dict(sorted({**changes["new"], **changes["modified"]}.items()))
+    parse = partial(parse_pdf, keep_original=args.keep_original_images, max_dimension=args.max_image_size)
+    parsed = list(map_pdfs(parse, list(to_index), workers=args.workers))
+
+    # EMBED EVERY NEW CHUNK BY TOKEN BUDGET, each batch lands in the embedding cache as soon as it is done
+    # so an interrupted run resumes from there, and the additions below are served by the cache
+    texts = [doc.page_content for result in parsed for doc in result["docs"]]
+    if texts:
+      embed_in_batches(vector_store.embeddings, texts, max_tokens=args.embed_batch_tokens, concurrency=args.embed_concurrency)
+
+    for (pdf_file, info), result in zip(to_index.items(), parsed):
+      docs = result["docs"]
+      chunk_ids = [str(uuid.uuid4()) for _ in docs]
+      if docs:
+        vector_store.add_documents(docs, ids=chunk_ids)
+      manifest[pdf_file] = {
+        **info,
+        "chunk_ids": chunk_ids,
+        "main_image": result["main_image"],
+        "step_images": result["step_images"],
+      }
+      save_manifest(manifest, MANIFEST_PATH) # keep progress if the run is interrupted
+      print(f"✅ {pdf_file} : {len(docs)} chunks indexés")
+
+    save_manifest(manifest, MANIFEST_PATH)
     print("✅ Vector store initialisé dans", PERSIST_DIR)
+    print("🧮 Cache d'embeddings :", vector_store.embeddings.stats())
     init_db() # INIT DB POSTGRESQL
     print("✅ db initialisée")
-    
\ No newline at end of file
@@ -2,21 +2,73 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import json
+import asyncio
+from openai import RateLimitError
 from langchain.chat_models import init_chat_model
 from typing_extensions import List, TypedDict, Optional
 from langgraph.graph import START, StateGraph
-from initiate_csv import prompt, LLM_NAME
+from initiate_csv import prompt, free_text_prompt, LLM_NAME
 from pydantic import BaseModel, ValidationError
-from models import SessionLocal, BatteryPackModel,StepModel, SubStepModel, ToolModel, PictureModel
-import uuid
-import os, re, requests, json
-from urllib.parse import urlparse
+from models import SessionLocal, bulk_insert_battery_packs, upsert_battery_packs
+import os, re, json
+import argparse
 import pandas as pd
+from utils.downloads import download_images
+from utils.llm_cache import enable_llm_cache
+from utils.structured import aextract_structured
+from utils.csv_extract import split_csv_batches, merge_battery_packs, structured_columns, free_text_frame, assemble_hybrid
 
 DOCS_PATH = "docs/Disassembly.csv"
 
+parser = argparse.ArgumentParser(description="Extract the battery packs of the CSV and load them into the db")
+parser.add_argument("--chunked", action="store_true", help="split the CSV in row batches extracted concurrently")
+parser.add_argument("--batch-rows", type=int, default=20, help="max rows per batch in chunked mode")
+parser.add_argument("--max-concurrency", type=int, default=4, help="max LLM calls running at the same time in chunked / hybrid mode")
+parser.add_argument("--hybrid", action="store_true", help="read name, number, time and tools from the columns, use the LLM only for sub-steps and risks")
+parser.add_argument("--upsert", action="store_true", help="update the packs already in db (matched by name / step number) instead of inserting new ones")
+parser.add_argument("--no-cache", action="store_true", help="always call the LLM, ignore the response cache")
+args = parser.parse_args()
+
+llm_cache = None if args.no_cache else enable_llm_cache()
+
+df = pd.read_csv(DOCS_PATH, encoding="utf-8")
+
 llm = init_chat_model(LLM_NAME, model_provider="openai")
 
+# -------------------------- ANSWER SCHEMA --------------------------
+class SubStep(BaseModel):
+    name: str
+    number: int
+    
+class Tool(BaseModel):
+    name: str
+
+class Step(BaseModel):
+    name: str
+    number: int
+    time: Optional[float]
+    risks: Optional[str] = None
+    sub_steps: List[SubStep]
+    pictures: Optional[List[str]] = None
+    tools: List[Tool]
+
+class BatteryPack(BaseModel):
+    name: str
+    picture: Optional[str] = None
+    steps: List[Step]
+
+class BatteryPacksList(BaseModel):
+    batteryPacks: List[BatteryPack]
+
+# hybrid mode : the LLM only reads the free text columns of each row
+class FreeTextRow(BaseModel):
+    row: int
+    risks: Optional[str] = None
+    sub_steps: List[SubStep]
+
+class FreeTextRows(BaseModel):
+    rows: List[FreeTextRow]
+
 class State(TypedDict):
     question: str
     context: List[str]
@@ -24,18 +76,47 @@ class State(TypedDict):
     
 # --------------------------- GRAPH STEPS --------------------------- 
 def retrieve(state: State) -> dict:
-    with open(DOCS_PATH, encoding="utf-8") as f:
-        full_csv = f.read()
-    return {"context": [full_csv]}
-
-def generate(state: State) -> dict:
-    context_text = state["context"][0] # the whole CSV file
-    messages = prompt.invoke({
-        "question": state["question"], 
-        "context": context_text,
-         })
-    answer = llm.invoke(messages)
-    return {"answer": answer.content}
+    if args.hybrid:
+        # only the free text columns are sent to the LLM
+        max_rows = args.batch_rows if args.chunked else max(len(df), 1)
+        return {"context": split_csv_batches(free_text_frame(df), max_rows=max_rows)}
+    if not args.chunked:
+        with open(DOCS_PATH, encoding="utf-8") as f:
+            full_csv = f.read()
+        return {"context": [full_csv]}
+    # one CSV text per batch of rows of the same battery pack
+    return {"context": split_csv_batches(df, max_rows=args.batch_rows)}
+
+async def generate(state: State) -> dict:
+    template, schema = (free_text_prompt, FreeTextRows) if args.hybrid else (prompt, BatteryPacksList)
+    messages = [
+        template.invoke({
+            "question": state["question"], 
+            "context": context_text,
+            })
+        for context_text in state["context"]
+    ]
+
+    # one structured call per batch, at most max_concurrency at a time, results kept in batch order
+    semaphore = asyncio.Semaphore(args.max_concurrency)
+    async def extract(batch_messages):
+        async with semaphore:
+            return await aextract_structured(llm, batch_messages, schema, retry_exceptions=(RateLimitError,))
+    answers = await asyncio.gather(*(extract(m) for m in messages), return_exceptions=True)
+
+    partials = []
+    for idx, answer in enumerate(answers):
+        if isinstance(answer, Exception):
+            print(f"❌ Erreur sur le batch {idx} :", answer)
+            continue
+        partials.append(answer.model_dump())
+
+    if args.hybrid:
+        free_text_rows = {r["row"]: r for partial in partials for r in partial["rows"]}
+        merged = assemble_hybrid(structured_columns(df), free_text_rows)
+    else:
+        merged = merge_battery_packs(partials)
+    return {"answer": json.dumps(merged, ensure_ascii=False)}
 
 # -------------------------- INITIATE GRAPH -------------------------
 graph = (
@@ -57,11 +138,17 @@ question = (
     "4. Summarize the Identified Risk column as a comma-separated list, omitting any purely repetitive-task risks.\n"
 )
 
-result = graph.invoke({ "question": question })
+hybrid_question = (
+    "Given this CSV with columns: Row, Description, Identified Risk, do the following for every row: \n"
+    "1. From the Description field, break out each numbered line into a concise bullet-point sub-step.\n"
+    "2. Summarize the Identified Risk column as a comma-separated list, omitting any purely repetitive-task risks.\n"
+    "3. Copy the Row value unchanged.\n"
+)
+
+result = asyncio.run(graph.ainvoke({ "question": hybrid_question if args.hybrid else question }))
 answer_text = result["answer"]
 
 # ------------------------- RETREIVE URL ---------------------------
-df = pd.read_csv(DOCS_PATH, encoding="utf-8")
 raw_pack = df["Battery Pack Model"].dropna().iloc[0] # Extract the bp name
 safe_pack = re.sub(r'[^A-Za-z0-9_-]', '_', raw_pack).lower() # Clean the bp name
 os.makedirs("images", exist_ok=True)
@@ -75,21 +162,7 @@ for _, row in df.iterrows():
     images_map[n] = urls
     
 # --------------------------- DL IMAGES -----------------------------
-local_images = {}
-for step_num, urls in images_map.items():
-    local_images[step_num] = []
-    for idx, url in enumerate(urls, 1):
-        try:
-            r = requests.get(url, timeout=10); r.raise_for_status()
-        except Exception as e:
-            print(f"Error while downloading {url}: {e}")
-            continue
-        ext = os.path.splitext(urlparse(url).path)[1] or ".jpg"
-        fname = f"{safe_pack}_step_{step_num}_img{idx}{ext}"
-        path = os.path.join("images", fname)
-        with open(path, "wb") as f:
-            f.write(r.content)
-        local_images[step_num].append(path)
+local_images = download_images(images_map, safe_pack, output_dir="images", workers=8)
 
 # ---------------------- ADD IMAGES TO THE JSON ----------------------
 
@@ -102,31 +175,6 @@ answer_text = json.dumps(data, ensure_ascii=False)
 
 
 # -------------------------- VERIFY ANSWER --------------------------
-class SubStep(BaseModel):
-    name: str
-    number: int
-    
-class Tool(BaseModel):
-    name: str
-
-class Step(BaseModel):
-    name: str
-    number: int
-    time: Optional[float]
-    risks: Optional[str] = None
-    sub_steps: List[SubStep]
-    pictures: Optional[List[str]] = None
-    tools: List[Tool]
-
-class BatteryPack(BaseModel):
-    name: str
-    picture: Optional[str] = None
-    steps: List[Step]
-
-class BatteryPacksList(BaseModel):
-    batteryPacks: List[BatteryPack] 
-
-
 try: 
     data = json.loads(answer_text)
     doc = BatteryPacksList(**data)
@@ -134,67 +182,20 @@ try:
 except(json.JSONDecodeError, ValidationError) as e:
       print("❌ Erreur de parsing :", e)
 
-doc_dict = doc.model_dump()
-
 # ----------------------- ADD ANSWER TO DB -------------------------
 session = SessionLocal()
 try: 
-    # BatteryPack
-    for pack in doc_dict["batteryPacks"]:
-        pack_id = str(uuid.uuid4())
-        bp = BatteryPackModel(
-            id=pack_id,
-            name=pack["name"],
-            picture=pack.get("picture")
-        )
-        # Steps
-        for step in pack["steps"]:
-            step_id = str(uuid.uuid4())
-            st = StepModel(
-                id=step_id,
-                name=step["name"],
-                number=step["number"],
-                risks=step["risks"],
-                time=step["time"],
-                batteryPack_id=pack_id
-            )  
-            # Sub Steps
-            for sub in step["sub_steps"]:
-                ss = SubStepModel(
-                    id=str(uuid.uuid4()),
-                    name=sub["name"],
-                    number=sub["number"],
-                    step_id=step_id
-                )
-                st.sub_steps.append(ss)
-                
-            # Pictures
-            for pic_path in step.get("pictures") or []:
-                pic_obj = PictureModel(
-                    id=str(uuid.uuid4()),
-                    link=pic_path,
-                    step_id=step_id,
-                )
-                st.pictures.append(pic_obj)
-            
-
-            # Tools
-            for tool in step["tools"]:
-                tool_obj = ToolModel(
-                    id=str(uuid.uuid4()),
-                    name=tool["name"],
-                    step_id=step_id,
-                )
-                st.tools.append(tool_obj)
-
-            bp.steps.append(st)
-
-        session.merge(bp)
-
+    if args.upsert:
+        counts = upsert_battery_packs(session, doc)
+    else:
+        counts = bulk_insert_battery_packs(session, doc)
     session.commit()
-    print("✅ Données insérées/mises à jour dans batteryPacks")
+    print("✅ Données insérées dans batteryPacks :", counts)
 except Exception as e:
     session.rollback()
     print("❌ Erreur en base :", e)
 finally:
     session.close()
+
+if llm_cache:
+    print("🧮 Cache LLM :", llm_cache.stats())
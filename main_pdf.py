@@ -1,30 +1,38 @@
+import os
 import json
+import argparse
+import asyncio
+from openai import RateLimitError
 from langchain.chat_models import init_chat_model
 from typing_extensions import List, TypedDict, Optional
 from langchain_core.documents import Document
 from langgraph.graph import START, StateGraph
-from initiate_pdf import create_vector_store, prompt, PERSIST_DIR, LLM_NAME
+from initiate_pdf import create_vector_store, prompt, step_prompt, pack_prompt, PERSIST_DIR, MANIFEST_PATH, LLM_NAME
 from pydantic import BaseModel, ValidationError
-from models import SessionLocal, BatteryPackModel,StepModel, SubStepModel, ToolModel, PictureModel
-import uuid
-from glob import glob
-import json
-from utils.images import extract_step_images 
+from models import SessionLocal, bulk_insert_battery_packs, upsert_battery_packs
+from utils.images import extract_step_images
+from utils.manifest import load_manifest
+from utils.llm_cache import enable_llm_cache
+from utils.structured import aextract_structured
+from utils.results import append_result
 
 llm = init_chat_model(LLM_NAME, model_provider="openai")
 vector_store = create_vector_store(PERSIST_DIR)
 
 class State(TypedDict):
     question: str
+    source: Optional[str] # restrict the retrieval to one PDF
+    pack: Optional[str] # restrict the retrieval to one pack (file name without extension)
+    full_document: bool # read every chunk of source in order instead of a similarity search
     context: List[Document]
     answer: str
 
 # --------------------------- EXTRACT STEP IMAGES ---------------------------
-DOCS_PATH = "docs/"
-
+# step images are extracted once per PDF by initiate_pdf.py and kept in the manifest
+manifest = load_manifest(MANIFEST_PATH)
 raw_map = {
-    pdf: extract_step_images(pdf)["step_images"]
-    for pdf in glob(f"{DOCS_PATH}/**/*.pdf", recursive=True)
+    pdf: entry["step_images"] if "step_images" in entry else extract_step_images(pdf)["step_images"]
+    for pdf, entry in manifest.items()
 }
 all_step_imgs = {}
 for pdf, steps in raw_map.items():
@@ -34,24 +42,81 @@ for pdf, steps in raw_map.items():
     all_step_imgs[pdf] = wrapped
 print(all_step_imgs)
     
+# -------------------------- ANSWER SCHEMA --------------------------
+class SubStep(BaseModel):
+    name: str
+    number: int
+
+class Picture(BaseModel):
+    link: str
+
+class Tool(BaseModel):
+    name: str
+
+class StepContent(BaseModel):
+    name: str
+    number: int
+    time: float
+    risks: str
+    sub_steps: List[SubStep]
+    tools: List[Tool]
+
+class Step(StepContent):
+    pictures: List[Picture]
+
+class PackName(BaseModel):
+    name: str
+
+class BatteryPack(BaseModel):
+    name: str
+    picture: Optional[str]
+    steps: List[Step]
+
+class BatteryPacksList(BaseModel):
+    batteryPacks: List[BatteryPack]
+
 # --------------------------- GRAPH STEPS --------------------------- 
-def retrieve(state: State) -> dict:
-    docs: List[Document] = vector_store.similarity_search(state["question"], k=35)
+def document_chunks(source: str) -> List[Document]:
+    """
+    Chunks of an indexed PDF in document order, read by id from the manifest (no vector search)
+    """
+    chunk_ids = manifest[source]["chunk_ids"]
+    position = {chunk_id: i for i, chunk_id in enumerate(chunk_ids)}
+    return sorted(vector_store.get_by_ids(chunk_ids), key=lambda doc: position[doc.id])
+
+def search_filter(source: Optional[str] = None, pack: Optional[str] = None) -> Optional[dict]:
+    """
+    Chroma where clause on the chunk metadata, None when there is nothing to filter on
+    """
+    clauses = [{key: value} for key, value in (("source", source), ("pack", pack)) if value]
+    if len(clauses) > 1:
+        return {"$and": clauses}
+    return clauses[0] if clauses else None
+
+async def retrieve(state: State) -> dict:
+    if state.get("full_document") and state.get("source"):
+        return { "context": await asyncio.to_thread(document_chunks, state["source"]) }
+    # the filter is applied by Chroma before ranking, other documents are never scored
+    where = search_filter(state.get("source"), state.get("pack"))
+    docs: List[Document] = await vector_store.asimilarity_search(state["question"], k=35, filter=where)
     return { "context": docs }
 
-def generate(state: State) -> dict:
+async def generate(state: State) -> dict:
+    if not state["context"]:
+        return {"answer": json.dumps({"batteryPacks": []})}
     top_chunk = state["context"][0]
     context_text = "\n\n".join(doc.page_content for doc in state["context"])
-    src = top_chunk.metadata["source"]
+    src = state.get("source") or top_chunk.metadata["source"]
     
     messages = prompt.invoke({
         "question": state["question"], 
         "context": context_text,
         "main_image": top_chunk.metadata.get("main_image", ""),
-        "step_images_map_json":  json.dumps(all_step_imgs[src])
+        "step_images_map_json":  json.dumps(all_step_imgs.get(src, {}))
          })
-    answer = llm.invoke(messages)
-    return {"answer": answer.content}
+    # the schema is sent as a forced tool call, invalid steps are repaired one by one
+    answer = await aextract_structured(llm, messages, BatteryPacksList, retry_exceptions=(RateLimitError,))
+    return {"answer": answer.model_dump_json()}
 
 # -------------------------- INITIATE GRAPH -------------------------
 graph = (
@@ -72,132 +137,172 @@ question = (
     "  5. Insert the corresponding photo paths (from metadata) under “pictures”."
 )
 
-result = graph.invoke({ "question": question })
-answer_text = result["answer"]
-
-# --------------------------- SAVE ANSWER ---------------------------
-answer_doc = Document(
-    page_content = answer_text,
-    metadata = {"source": "chat_response"},
+step_question = (
+    "Using this context, extract the disassembly step it describes (its “Step X: …” title gives the name and number)."
+    "Do the following:\n"
+    "  1. From the “Description:” section, generate concise bullet-point sub-steps.\n"
+    "  2. List required tools.\n"
+    "  3. Take the duration from the “Time Estimation:” field.\n"
+    "  4. Summarize the “Identified Risks:” in a single very short phrase,  excluding any risks related to repetitive tasks."
 )
-vector_store.add_documents([answer_doc])
 
-print(answer_text)
+pack_question = "Using this context, give the name of the battery pack this disassembly manual is about."
 
 # -------------------------- VERIFY ANSWER --------------------------
-class SubStep(BaseModel):
-    name: str
-    number: int
+def parse_answer(answer_text: str) -> Optional[BatteryPacksList]:
+    try: 
+        data = json.loads(answer_text)
+        doc = BatteryPacksList(**data)
+        print("✅ JSON valide, objet prêt à l'emploi")
+        return doc
+    except(json.JSONDecodeError, ValidationError) as e:
+        print("❌ Erreur de parsing :", e)
+        return None
 
-class Picture(BaseModel):
-    link: str
+# --------------------------- SAVE ANSWER ---------------------------
+# answers go to their own append-only file, never into the retrieval store
+def save_answer(answer_text: str, source: Optional[str] = None) -> str:
+    return append_result(answer_text, source=source)
 
-class Tool(BaseModel):
-    name: str
+# ----------------------- ADD ANSWER TO DB -------------------------
+def write_to_db(doc: BatteryPacksList, upsert: bool = False) -> None:
+    session = SessionLocal()
+    try: 
+        if upsert:
+            counts = upsert_battery_packs(session, doc)
+        else:
+            counts = bulk_insert_battery_packs(session, doc)
+        session.commit()
+        print("✅ Données insérées dans batteryPacks :", counts)
+    except Exception as e:
+        session.rollback()
+        print("❌ Erreur en base :", e)
+    finally:
+        session.close()
 
-class Step(BaseModel):
-    name: str
-    number: int
-    time: float
-    risks: str
-    sub_steps: List[SubStep]
-    pictures: List[Picture]
-    tools: List[Tool]
+# ---------------------- PER-DOCUMENT EXTRACTION ----------------------
+async def extract_document(source: Optional[str], semaphore: asyncio.Semaphore, **options) -> str:
+    """
+    options : pack / full_document, see State
+    """
+    async with semaphore:
+        result = await graph.ainvoke({ "question": question, "source": source, **options })
+    return result["answer"]
 
-class BatteryPack(BaseModel):
-    name: str
-    picture: Optional[str]
-    steps: List[Step]
+# ------------------------ PER-STEP EXTRACTION ------------------------
+async def extract_step(number: int, chunks: List[Document], pictures: list, semaphore: asyncio.Semaphore) -> Step:
+    messages = step_prompt.invoke({
+        "question": step_question,
+        "context": "\n\n".join(doc.page_content for doc in chunks),
+    })
+    async with semaphore:
+        content = await aextract_structured(llm, messages, StepContent, retry_exceptions=(RateLimitError,))
+    # the number comes from the step boundaries, the pictures from the manifest, not from the model
+    return Step(**{**content.model_dump(), "number": number}, pictures=pictures)
 
-class BatteryPacksList(BaseModel):
-    batteryPacks: List[BatteryPack]
+async def extract_pack_name(chunks: List[Document], semaphore: asyncio.Semaphore) -> str:
+    messages = pack_prompt.invoke({
+        "question": pack_question,
+        "context": "\n\n".join(doc.page_content for doc in chunks),
+    })
+    async with semaphore:
+        pack = await aextract_structured(llm, messages, PackName, retry_exceptions=(RateLimitError,))
+    return pack.name
 
+async def extract_document_by_steps(source: str, semaphore: asyncio.Semaphore, **options) -> str:
+    """
+    Map-style extraction : every "Step N" section of the PDF is extracted by its own call,
+    all at the same time, and the pack is assembled from the steps.
+    The output size of a call is bounded by one step, whatever the length of the manual.
+    """
+    chunks = document_chunks(source)
+    steps_chunks = {}
+    for doc in chunks:
+        if "step" in doc.metadata:
+            steps_chunks.setdefault(doc.metadata["step"], []).append(doc)
+    if not steps_chunks:
+        # no "Step N" title found : extract the whole document at once
+        return await extract_document(source, semaphore, full_document=True)
 
-try: 
-    data = json.loads(answer_text)
-    doc = BatteryPacksList(**data)
-    print("✅ JSON valide, objet prêt à l'emploi")
-except(json.JSONDecodeError, ValidationError) as e:
-      print("❌ Erreur de parsing :", e)
-
-doc_dict = doc.model_dump()
-
-# -------------------------- ADD ALL ID --------------------------
-for pack in doc_dict["batteryPacks"]:
-        pack_id = uuid.uuid4()
-        pack["id"] = str(pack_id)
-        for step in pack["steps"]:
-            step_id = uuid.uuid4()
-            step["id"] = str(step_id)
-            step["batteryPack_id"] = str(pack_id)
-            for sub in step["sub_steps"]:
-                sub_id = uuid.uuid4()
-                sub["id"] = str(sub_id)
-                sub["step_id"] = str(step_id)
-            for pic in step["pictures"]:
-                pic_id = uuid.uuid4()
-                pic["id"] = str(pic_id)
-                pic["step_id"] = str(step_id)
-            for tool in step["tools"]:
-                tool_id = uuid.uuid4()
-                tool["id"] = str(tool_id)
-                tool["step_id"] = str(step_id)
+    # the text before the first step (title page, introduction) names the pack
+    first_step = chunks.index(next(iter(steps_chunks.values()))[0])
+    header_chunks = chunks[:first_step] or chunks[:1]
 
-# ----------------------- ADD ANSWER TO DB -------------------------
-session = SessionLocal()
-try: 
-    # BatteryPack
-    for pack in doc_dict["batteryPacks"]:
-        bp = BatteryPackModel(
-            id=pack["id"],
-            name=pack["name"],
-            picture=pack.get("picture")
-        )
-        # Steps
-        for step in pack["steps"]:
-            st = StepModel(
-                id=step["id"],
-                name=step["name"],
-                number=step["number"],
-                risks=step["risks"],
-                time=step["time"],
-                batteryPack_id=step["batteryPack_id"]
-            )  
-            # Sub Steps
-            for sub in step["sub_steps"]:
-                ss = SubStepModel(
-                    id=sub["id"],
-                    name=sub["name"],
-                    number=sub["number"],
-                    step_id=sub["step_id"]
-                )
-                st.sub_steps.append(ss)
-
-            # Pictures
-            for pic in step["pictures"]:
-                pic_obj = PictureModel(
-                    id=pic["id"],
-                    link=pic["link"],
-                    step_id=pic["step_id"]
-                )
-                st.pictures.append(pic_obj)
-            # Tools
-            for tool in step["tools"]:
-                tool_obj = ToolModel(
-                    id=tool["id"],
-                    name=tool["name"],
-                    step_id=tool["step_id"]
-                )
-                st.tools.append(tool_obj)
-
-            bp.steps.append(st)
-
-        session.merge(bp)
-
-    session.commit()
-    print("✅ Données insérées/mises à jour dans batteryPacks")
-except Exception as e:
-    session.rollback()
-    print("❌ Erreur en base :", e)
-finally:
-    session.close()
+    step_images = all_step_imgs.get(source, {})
+    numbers = sorted(steps_chunks)
+    pack_name, *steps = await asyncio.gather(
+        extract_pack_name(header_chunks, semaphore),
+        *(extract_step(n, steps_chunks[n], step_images.get(f"Step {n}", []), semaphore) for n in numbers),
+        return_exceptions=True,
+    )
+    if isinstance(pack_name, Exception):
+        raise pack_name
+    # an incomplete pack is never written : the whole document fails with its missing steps
+    failed = {number: step for number, step in zip(numbers, steps) if isinstance(step, Exception)}
+    if failed:
+        for number, error in failed.items():
+            print(f"❌ Erreur sur l'étape {number} de {source} :", error)
+        raise RuntimeError(f"étape(s) manquante(s) pour {source} : {', '.join(map(str, failed))}")
+
+    pack = BatteryPack(
+        name=pack_name,
+        picture=manifest[source].get("main_image") or None,
+        steps=steps,
+    )
+    return BatteryPacksList(batteryPacks=[pack]).model_dump_json()
+
+async def extract_documents(sources: List[Optional[str]], concurrency: int, per_step: bool = False, **options) -> list:
+    """
+    Run the extraction on every PDF, at most `concurrency` LLM calls at a time
+    (one call per document, or per step with per_step)
+    Return the answers (or the exception raised) in the order of sources
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    extract = extract_document_by_steps if per_step else extract_document
+    return await asyncio.gather(
+        *(extract(source, semaphore, **options) for source in sources),
+        return_exceptions=True,
+    )
+
+# ------------------------------ RUN --------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract the battery packs of the PDFs and load them into the db")
+    parser.add_argument("--upsert", action="store_true", help="update the packs already in db (matched by name / step number) instead of inserting new ones")
+    parser.add_argument("--per-document", action="store_true", help="run one extraction per indexed PDF instead of a single question over the whole store")
+    parser.add_argument("--per-step", action="store_true", help="one extraction per step of every indexed PDF, assembled into its pack (implies --per-document)")
+    parser.add_argument("--pack", default=None, help="only extract this pack (PDF file name without extension)")
+    parser.add_argument("--full-document", action="store_true", help="with --per-document, send every chunk of the PDF in order instead of the 35 closest ones")
+    parser.add_argument("--concurrency", type=int, default=4, help="max LLM calls running at the same time with --per-document / --per-step")
+    parser.add_argument("--no-cache", action="store_true", help="always call the LLM, ignore the response cache")
+    args = parser.parse_args()
+
+    llm_cache = None if args.no_cache else enable_llm_cache()
+
+    if args.per_document or args.per_step:
+        sources = [
+            pdf for pdf in sorted(manifest)
+            if args.pack is None or os.path.splitext(os.path.basename(pdf))[0] == args.pack
+        ]
+        options = {"full_document": args.full_document}
+    else:
+        # a single question over the whole store (or the chunks of one pack), without source filter
+        sources = [None]
+        options = {"pack": args.pack}
+    answers = asyncio.run(extract_documents(sources, args.concurrency, per_step=args.per_step, **options))
+
+    for source, answer_text in zip(sources, answers):
+        if source:
+            print(f"📄 {source}")
+        if isinstance(answer_text, Exception):
+            print("❌ Erreur LLM :", answer_text)
+            continue
+
+        print("💾 Réponse enregistrée :", save_answer(answer_text, source))
+        print(answer_text)
+
+        doc = parse_answer(answer_text)
+        if doc is not None:
+            write_to_db(doc, upsert=args.upsert)
+
+    if llm_cache:
+        print("🧮 Cache LLM :", llm_cache.stats())
@@ -2,11 +2,16 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from datetime import timezone, datetime
-from sqlalchemy import create_engine,Column, String, Integer, ForeignKey, Float, DateTime, Boolean
+from sqlalchemy import create_engine,Column, String, Integer, ForeignKey, Float, DateTime, Boolean, UniqueConstraint, insert, select, delete, or_, tuple_, event, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
 import uuid
+import io
 
 import os
 
@@ -21,7 +26,7 @@ class BatteryPackModel(Base):
     __tablename__ = "batteryPack"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    name = Column(String, nullable=False)
+    name = Column(String, nullable=False, unique=True)
     picture = Column(String, nullable=True)
 
     # relationships
@@ -30,6 +35,7 @@ class BatteryPackModel(Base):
 
 class StepModel(Base):
     __tablename__ = "steps"
+    __table_args__ = (UniqueConstraint("batteryPack_id", "number", name="uq_steps_batteryPack_id_number"),)
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = Column(String, nullable=False)
@@ -49,6 +55,7 @@ class StepModel(Base):
 
 class SubStepModel(Base):
     __tablename__ = "sub_steps"
+    __table_args__ = (UniqueConstraint("step_id", "number", name="uq_sub_steps_step_id_number"),)
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = Column(String, nullable=False)
@@ -60,6 +67,7 @@ class SubStepModel(Base):
 
 class PictureModel(Base):
     __tablename__ = "pictures"
+    __table_args__ = (UniqueConstraint("step_id", "link", name="uq_pictures_step_id_link"),)
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     link = Column(String, nullable=False)
@@ -70,6 +78,7 @@ class PictureModel(Base):
 
 class ToolModel(Base):
     __tablename__ = "tools"
+    __table_args__ = (UniqueConstraint("step_id", "name", name="uq_tools_step_id_name"),)
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = Column(String, nullable=False)
@@ -82,7 +91,7 @@ class DisassemblyModel(Base):
     __tablename__ = "disassemblies"
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     total_time = Column(Integer, nullable=False)
-    batteryPack_id = Column(UUID(as_uuid=True), ForeignKey("batteryPack.id"), nullable=False)
+    batteryPack_id = Column(UUID(as_uuid=True), ForeignKey("batteryPack.id"), nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.now(timezone.utc)) 
 
     # relationships
@@ -93,8 +102,8 @@ class TimerModel(Base):
     __tablename__ = "timers"
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     length = Column(Integer, nullable=False)
-    step_id = Column(UUID(as_uuid=True), ForeignKey("steps.id"), nullable=False)
-    disassembly_id = Column(UUID(as_uuid=True), ForeignKey("disassemblies.id"), nullable=False)
+    step_id = Column(UUID(as_uuid=True), ForeignKey("steps.id"), nullable=False, index=True)
+    disassembly_id = Column(UUID(as_uuid=True), ForeignKey("disassemblies.id"), nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.now(timezone.utc)) 
 
     # relationships
@@ -105,20 +114,408 @@ class CommentModel(Base):
     __tablename__ = "comments"
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     text = Column(String, nullable=False)
-    step_id = Column(UUID(as_uuid=True), ForeignKey("steps.id"), nullable=False)
+    step_id = Column(UUID(as_uuid=True), ForeignKey("steps.id"), nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.now(timezone.utc)) 
     save = Column(Boolean, default=False)
 
     # relationships
     step = relationship("StepModel", back_populates="comments")
 
+class StepTimerStatsModel(Base):
+    """
+    Aggregate of the timers of a step, maintained by the triggers of TIMER_STATS_DDL
+    """
+    __tablename__ = "step_timer_stats"
+    step_id = Column(UUID(as_uuid=True), ForeignKey("steps.id", ondelete="CASCADE"), primary_key=True)
+    batteryPack_id = Column(UUID(as_uuid=True), ForeignKey("batteryPack.id", ondelete="CASCADE"), nullable=False, index=True)
+    count = Column(Integer, nullable=False)
+    mean = Column(Float, nullable=True)
+    p50 = Column(Float, nullable=True)
+    p90 = Column(Float, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+
+class PackTimerStatsModel(Base):
+    """
+    Per-pack totals : estimated time (sum of StepModel.time), measured time (sum of step means)
+    and the total_time of the disassemblies, maintained by the triggers of TIMER_STATS_DDL
+    """
+    __tablename__ = "pack_timer_stats"
+    batteryPack_id = Column(UUID(as_uuid=True), ForeignKey("batteryPack.id", ondelete="CASCADE"), primary_key=True)
+    estimated_time = Column(Float, nullable=True)
+    measured_time = Column(Float, nullable=True)
+    disassembly_count = Column(Integer, nullable=False)
+    mean_total_time = Column(Float, nullable=True)
+    p50_total_time = Column(Float, nullable=True)
+    p90_total_time = Column(Float, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+
+
+# -------------------------- TIMER STATISTICS (POSTGRESQL) --------------------------
+# only the steps / packs touched by an INSERT statement are recomputed,
+# so dashboards read O(steps) rows instead of aggregating every timer
+
+TIMER_STATS_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION refresh_step_timer_stats(step_ids uuid[]) RETURNS void AS $$
+    BEGIN
+        DELETE FROM step_timer_stats st
+        WHERE st.step_id = ANY(step_ids)
+          AND NOT EXISTS (SELECT 1 FROM timers t WHERE t.step_id = st.step_id);
+
+        INSERT INTO step_timer_stats (step_id, "batteryPack_id", count, mean, p50, p90, updated_at)
+        SELECT t.step_id, s."batteryPack_id", count(*), avg(t.length),
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY t.length),
+               percentile_cont(0.9) WITHIN GROUP (ORDER BY t.length),
+               now()
+        FROM timers t JOIN steps s ON s.id = t.step_id
+        WHERE t.step_id = ANY(step_ids)
+        GROUP BY t.step_id, s."batteryPack_id"
+        ON CONFLICT (step_id) DO UPDATE SET
+            count = EXCLUDED.count, mean = EXCLUDED.mean, p50 = EXCLUDED.p50,
+            p90 = EXCLUDED.p90, updated_at = EXCLUDED.updated_at;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION refresh_pack_timer_stats(pack_ids uuid[]) RETURNS void AS $$
+    BEGIN
+        INSERT INTO pack_timer_stats ("batteryPack_id", estimated_time, measured_time, disassembly_count,
+                                      mean_total_time, p50_total_time, p90_total_time, updated_at)
+        SELECT bp.id,
+               (SELECT sum(s.time) FROM steps s WHERE s."batteryPack_id" = bp.id),
+               (SELECT sum(st.mean) FROM step_timer_stats st WHERE st."batteryPack_id" = bp.id),
+               d.n, d.mean, d.p50, d.p90, now()
+        FROM "batteryPack" bp
+        CROSS JOIN LATERAL (
+            SELECT count(*) AS n, avg(total_time) AS mean,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY total_time) AS p50,
+                   percentile_cont(0.9) WITHIN GROUP (ORDER BY total_time) AS p90
+            FROM disassemblies WHERE "batteryPack_id" = bp.id
+        ) d
+        WHERE bp.id = ANY(pack_ids)
+        ON CONFLICT ("batteryPack_id") DO UPDATE SET
+            estimated_time = EXCLUDED.estimated_time, measured_time = EXCLUDED.measured_time,
+            disassembly_count = EXCLUDED.disassembly_count, mean_total_time = EXCLUDED.mean_total_time,
+            p50_total_time = EXCLUDED.p50_total_time, p90_total_time = EXCLUDED.p90_total_time,
+            updated_at = EXCLUDED.updated_at;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION timers_refresh_stats() RETURNS trigger AS $$
+    BEGIN
+        PERFORM refresh_step_timer_stats(ARRAY(SELECT DISTINCT step_id FROM new_timers));
+        PERFORM refresh_pack_timer_stats(ARRAY(
+            SELECT DISTINCT s."batteryPack_id" FROM new_timers n JOIN steps s ON s.id = n.step_id
+        ));
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION disassemblies_refresh_stats() RETURNS trigger AS $$
+    BEGIN
+        PERFORM refresh_pack_timer_stats(ARRAY(SELECT DISTINCT "batteryPack_id" FROM new_disassemblies));
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS timers_refresh_stats ON timers",
+    """
+    CREATE TRIGGER timers_refresh_stats AFTER INSERT ON timers
+    REFERENCING NEW TABLE AS new_timers
+    FOR EACH STATEMENT EXECUTE FUNCTION timers_refresh_stats()
+    """,
+    "DROP TRIGGER IF EXISTS disassemblies_refresh_stats ON disassemblies",
+    """
+    CREATE TRIGGER disassemblies_refresh_stats AFTER INSERT ON disassemblies
+    REFERENCING NEW TABLE AS new_disassemblies
+    FOR EACH STATEMENT EXECUTE FUNCTION disassemblies_refresh_stats()
+    """,
+]
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_timer_stats_triggers(target, connection, **kw):
+    # init_db() gets the same functions & triggers as the alembic migration
+    if connection.dialect.name == "postgresql":
+        for statement in TIMER_STATS_DDL:
+            connection.execute(text(statement))
+
+def refresh_timer_stats(session, step_ids=None, pack_ids=None):
+    """
+    Recompute the stats of some steps / packs (all of them when None),
+    e.g. after timers were deleted or edited. Inserts are handled by the triggers.
+    """
+    if step_ids is None:
+        session.execute(text("SELECT refresh_step_timer_stats(ARRAY(SELECT id FROM steps))"))
+    elif step_ids:
+        session.execute(text("SELECT refresh_step_timer_stats(CAST(:ids AS uuid[]))"), {"ids": [str(i) for i in step_ids]})
+    if pack_ids is None:
+        session.execute(text('SELECT refresh_pack_timer_stats(ARRAY(SELECT id FROM "batteryPack"))'))
+    elif pack_ids:
+        session.execute(text("SELECT refresh_pack_timer_stats(CAST(:ids AS uuid[]))"), {"ids": [str(i) for i in pack_ids]})
+
 
 # -------------------------- CREATE DB --------------------------
     
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine)
+def _env_flag(name, default):
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+def _engine_options():
+    """
+    Engine settings from the environment :
+      DB_NULLPOOL=1            no pool, one connection per session (behind PgBouncer)
+      DB_POOL_SIZE=5           connections kept open per process
+      DB_MAX_OVERFLOW=10       extra connections allowed under load
+      DB_POOL_TIMEOUT=30       seconds to wait for a free connection
+      DB_POOL_RECYCLE=1800     seconds before a connection is replaced
+      DB_POOL_PRE_PING=1       check connections before use
+      DB_STATEMENT_TIMEOUT_MS  PostgreSQL statement_timeout (unset = no timeout)
+    """
+    url = make_url(DATABASE_URL)
+    options = {"pool_pre_ping": _env_flag("DB_POOL_PRE_PING", True)}
+
+    if _env_flag("DB_NULLPOOL", False):
+        options["poolclass"] = NullPool
+    elif url.get_backend_name() != "sqlite":
+        options.update(
+            pool_size=int(os.getenv("DB_POOL_SIZE", 5)),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 10)),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", 30)),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", 1800)),
+        )
+
+    statement_timeout = os.getenv("DB_STATEMENT_TIMEOUT_MS")
+    if statement_timeout and url.get_backend_name() == "postgresql":
+        options["connect_args"] = {"options": f"-c statement_timeout={int(statement_timeout)}"}
+    return options
+
+_engine = None
+
+def get_engine():
+    """
+    Engine created on first use (importing models.py opens nothing)
+    """
+    global _engine
+    if _engine is None:
+        _engine = create_engine(DATABASE_URL, **_engine_options())
+    return _engine
+
+def __getattr__(name):
+    # models.engine is still available, built lazily
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+_session_factory = sessionmaker()
+
+def SessionLocal():
+    return _session_factory(bind=get_engine())
 
 def init_db():
-    Base.metadata.create_all(engine)
\ No newline at end of file
+    Base.metadata.create_all(get_engine())
+
+
+# -------------------------- BULK INSERT --------------------------
+
+def _csv_value(value):
+    """
+    CSV field for COPY : NULL is an unquoted empty field, every string is quoted
+    so an empty string stays an empty string
+    """
+    if value is None:
+        return ""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+def _copy_rows(session, table, rows):
+    """
+    PostgreSQL COPY of rows (list of dicts with the same keys) into table
+    """
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(",".join(_csv_value(row[c]) for c in columns) + "\n")
+    buffer.seek(0)
+
+    column_list = ", ".join(f'"{c}"' for c in columns)
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY "{table.name}" ({column_list}) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+def bulk_insert_battery_packs(session, packs, use_copy=False):
+    """
+    Write a validated BatteryPacksList with one multi-row INSERT per table
+    (or COPY on PostgreSQL when use_copy=True), in the transaction of session.
+    Ids are generated here. The caller commits or rolls back.
+    Return the number of rows written per table.
+    """
+    data = packs.model_dump() if hasattr(packs, "model_dump") else packs
+    # rows by natural key (same keys as the unique constraints / upsert_battery_packs) :
+    # a pack, step or child repeated in the answer is written once, the last occurrence wins
+    # and the children of a repeated pack / step are attached to the same id
+    keyed = {"batteryPack": {}, "steps": {}, "sub_steps": {}, "pictures": {}, "tools": {}}
+
+    for pack in data["batteryPacks"]:
+        previous = keyed["batteryPack"].get(pack["name"])
+        pack_id = previous["id"] if previous else uuid.uuid4()
+        keyed["batteryPack"][pack["name"]] = {"id": pack_id, "name": pack["name"], "picture": pack.get("picture")}
+        for step in pack["steps"]:
+            previous = keyed["steps"].get((pack_id, step["number"]))
+            step_id = previous["id"] if previous else uuid.uuid4()
+            keyed["steps"][(pack_id, step["number"])] = {
+                "id": step_id,
+                "name": step["name"],
+                "number": step["number"],
+                "time": step.get("time"),
+                "risks": step.get("risks"),
+                "batteryPack_id": pack_id,
+            }
+            for sub in step["sub_steps"]:
+                keyed["sub_steps"][(step_id, sub["number"])] = {"id": uuid.uuid4(), "name": sub["name"], "number": sub["number"], "step_id": step_id}
+            # pictures are {"link": ...} (pdf) or plain paths (csv)
+            for pic in step.get("pictures") or []:
+                link = pic["link"] if isinstance(pic, dict) else pic
+                keyed["pictures"][(step_id, link)] = {"id": uuid.uuid4(), "link": link, "step_id": step_id}
+            for tool in step["tools"]:
+                keyed["tools"][(step_id, tool["name"])] = {"id": uuid.uuid4(), "name": tool["name"], "step_id": step_id}
+
+    rows = {name: list(by_key.values()) for name, by_key in keyed.items()}
+
+    # parents first for the foreign keys
+    tables = [BatteryPackModel, StepModel, SubStepModel, PictureModel, ToolModel]
+    copy = use_copy and session.get_bind().dialect.name == "postgresql"
+    for model in tables:
+        table_rows = rows[model.__tablename__]
+        if not table_rows:
+            continue
+        if copy:
+            _copy_rows(session, model.__table__, table_rows)
+        else:
+            # executemany : batched into multi-row VALUES by SQLAlchemy (insertmanyvalues)
+            session.execute(insert(model.__table__), table_rows)
+
+    return {name: len(table_rows) for name, table_rows in rows.items()}
+
+
+# -------------------------- UPSERT WITH NATURAL KEYS --------------------------
+
+def _dialect_insert(session):
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        return pg_insert
+    if dialect == "sqlite":
+        return sqlite_insert
+    raise ValueError(f"upsert not supported on {dialect}")
+
+def _upsert(session, model, rows, keys, batch_size=1000):
+    """
+    INSERT ... ON CONFLICT (keys) DO UPDATE, only for rows where a non-key column changed.
+    Return ({natural key: id}, number of rows inserted or updated)
+    """
+    table = model.__table__
+    # the same key twice in one statement is refused by PostgreSQL : keep the last one
+    rows = list({tuple(r[k] for k in keys): r for r in rows}.values())
+    updatable = [c for c in rows[0] if c not in keys and c != "id"]
+    written = 0
+
+    for start in range(0, len(rows), batch_size):
+        stmt = _dialect_insert(session)(table).values(rows[start:start + batch_size])
+        if updatable:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=keys,
+                set_={c: stmt.excluded[c] for c in updatable},
+                where=or_(*[table.c[c].is_distinct_from(stmt.excluded[c]) for c in updatable]),
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+        written += session.execute(stmt).rowcount
+
+    # ids of new and existing rows
+    key_columns = [table.c[k] for k in keys]
+    ids = {}
+    for start in range(0, len(rows), batch_size):
+        batch_keys = [tuple(r[k] for k in keys) for r in rows[start:start + batch_size]]
+        for row in session.execute(select(table.c.id, *key_columns).where(tuple_(*key_columns).in_(batch_keys))):
+            ids[tuple(row[1:])] = row[0]
+    return ids, written
+
+def _delete_stale(session, model, keys, rows, step_ids):
+    """
+    Delete the children of the given steps that are not in rows anymore
+    """
+    if not step_ids:
+        return 0
+    table = model.__table__
+    key_columns = [table.c[k] for k in keys]
+    stmt = delete(table).where(table.c.step_id.in_(step_ids))
+    if rows:
+        stmt = stmt.where(tuple_(*key_columns).not_in([tuple(r[k] for k in keys) for r in rows]))
+    return session.execute(stmt).rowcount
+
+def upsert_battery_packs(session, packs):
+    """
+    Write a validated BatteryPacksList using natural keys :
+      pack name / (pack, step number) / (step, sub-step number) / (step, tool name) / (step, picture link)
+    Re-running on the same answer updates in place, only changed rows are written.
+    Sub-steps, tools and pictures that disappeared from a step are deleted
+    (steps are kept : timers and comments point to them).
+    The caller commits or rolls back. Return the number of rows written per table.
+    """
+    data = packs.model_dump() if hasattr(packs, "model_dump") else packs
+    counts = {}
+    if not data["batteryPacks"]:
+        return counts
+
+    # BatteryPacks
+    pack_rows = [{"id": uuid.uuid4(), "name": p["name"], "picture": p.get("picture")} for p in data["batteryPacks"]]
+    pack_ids, counts["batteryPack"] = _upsert(session, BatteryPackModel, pack_rows, ["name"])
+
+    # Steps
+    step_rows = [
+        {
+            "id": uuid.uuid4(),
+            "name": step["name"],
+            "number": step["number"],
+            "time": step.get("time"),
+            "risks": step.get("risks"),
+            "batteryPack_id": pack_ids[(pack["name"],)],
+        }
+        for pack in data["batteryPacks"]
+        for step in pack["steps"]
+    ]
+    step_ids = {}
+    if step_rows:
+        step_ids, counts["steps"] = _upsert(session, StepModel, step_rows, ["batteryPack_id", "number"])
+
+    # Children of the steps
+    children = {"sub_steps": [], "tools": [], "pictures": []}
+    for pack in data["batteryPacks"]:
+        for step in pack["steps"]:
+            step_id = step_ids[(pack_ids[(pack["name"],)], step["number"])]
+            for sub in step["sub_steps"]:
+                children["sub_steps"].append({"id": uuid.uuid4(), "name": sub["name"], "number": sub["number"], "step_id": step_id})
+            for tool in step["tools"]:
+                children["tools"].append({"id": uuid.uuid4(), "name": tool["name"], "step_id": step_id})
+            for pic in step.get("pictures") or []:
+                link = pic["link"] if isinstance(pic, dict) else pic
+                children["pictures"].append({"id": uuid.uuid4(), "link": link, "step_id": step_id})
+
+    natural_keys = {"sub_steps": ["step_id", "number"], "tools": ["step_id", "name"], "pictures": ["step_id", "link"]}
+    for model in [SubStepModel, ToolModel, PictureModel]:
+        name = model.__tablename__
+        rows, keys = children[name], natural_keys[name]
+        deleted = _delete_stale(session, model, keys, rows, list(step_ids.values()))
+        written = _upsert(session, model, rows, keys)[1] if rows else 0
+        counts[name] = written + deleted
+
+    # StepModel.time may have changed : keep the estimated time of the pack stats in sync
+    if session.get_bind().dialect.name == "postgresql":
+        refresh_timer_stats(session, step_ids=[], pack_ids=list(pack_ids.values()))
+
+    return counts
@@ -1,7 +1,6 @@
 import os
 os.environ["USER_AGENT"] = "MonScript/1.0 (+https://github.com/eigsi)"
 from langchain.chat_models import init_chat_model
-from langchain_openai import OpenAIEmbeddings
 from langchain_chroma import Chroma
 from langchain_community.document_loaders import DirectoryLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -10,6 +9,7 @@ from typing_extensions import List, TypedDict
 from langchain_core.documents import Document
 from langgraph.graph import START, StateGraph
 from dotenv import load_dotenv
+from utils.embeddings import get_embeddings
 
 
 # Environment variables
@@ -21,9 +21,10 @@ os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
 # Choose llm model
 llm = init_chat_model("gpt-4.1-nano-2025-04-14", model_provider="openai")
 
-# Create vector store
+# Create vector store (embeddings are cached on disk between runs)
+embeddings = get_embeddings()
 vector_store = Chroma(
-    embedding_function=OpenAIEmbeddings(),
+    embedding_function=embeddings,
 )
 
 # load the document
@@ -76,4 +77,5 @@ graph = graph_builder.compile()
 response = graph.invoke({"question": "Quelles informations de ce documents tu pourrais mettre en tableau de façon pertiente ? fait le "})
 
 # Print
-print(response["answer"])
\ No newline at end of file
+print(response["answer"])
+print("Embedding cache:", embeddings.stats())
\ No newline at end of file
@@ -0,0 +1,184 @@
+from typing import NamedTuple, Optional
+from datetime import datetime
+import uuid
+from sqlalchemy import select, func
+from sqlalchemy.orm import selectinload, raiseload
+from models import SessionLocal, BatteryPackModel, StepModel, StepTimerStatsModel, PackTimerStatsModel
+
+
+# -------------------------- READ-ONLY STRUCTURES --------------------------
+
+class SubStepRow(NamedTuple):
+    name: str
+    number: int
+
+class TimerRow(NamedTuple):
+    length: int
+    disassembly_id: uuid.UUID
+    created_at: Optional[datetime]
+
+class CommentRow(NamedTuple):
+    text: str
+    save: Optional[bool]
+    created_at: Optional[datetime]
+
+class StepTree(NamedTuple):
+    id: uuid.UUID
+    name: str
+    number: int
+    time: Optional[float]
+    risks: Optional[str]
+    sub_steps: tuple[SubStepRow, ...]
+    tools: tuple[str, ...]
+    pictures: tuple[str, ...]
+    timers: tuple[TimerRow, ...]
+    comments: tuple[CommentRow, ...]
+
+class PackTree(NamedTuple):
+    id: uuid.UUID
+    name: str
+    picture: Optional[str]
+    steps: tuple[StepTree, ...]
+
+class StepTiming(NamedTuple):
+    number: int
+    name: str
+    estimated_time: Optional[float]
+    count: int
+    mean: Optional[float]
+    p50: Optional[float]
+    p90: Optional[float]
+
+class PackTiming(NamedTuple):
+    name: str
+    estimated_time: Optional[float]
+    measured_time: Optional[float]
+    disassembly_count: int
+    mean_total_time: Optional[float]
+    p50_total_time: Optional[float]
+    p90_total_time: Optional[float]
+    steps: tuple[StepTiming, ...]
+
+class PackSummary(NamedTuple):
+    id: uuid.UUID
+    name: str
+    picture: Optional[str]
+    step_count: int
+
+
+# -------------------------- QUERIES --------------------------
+
+# the whole step hierarchy in one SELECT per relationship, lazy loads forbidden
+_PACK_TREE_OPTIONS = (
+    selectinload(BatteryPackModel.steps).options(
+        selectinload(StepModel.sub_steps),
+        selectinload(StepModel.tools),
+        selectinload(StepModel.pictures),
+        selectinload(StepModel.timers),
+        selectinload(StepModel.comments),
+        raiseload("*"),
+    ),
+    raiseload("*"),
+)
+
+def _to_step_tree(step):
+    return StepTree(
+        id=step.id,
+        name=step.name,
+        number=step.number,
+        time=step.time,
+        risks=step.risks,
+        sub_steps=tuple(SubStepRow(s.name, s.number) for s in sorted(step.sub_steps, key=lambda s: s.number)),
+        tools=tuple(t.name for t in step.tools),
+        pictures=tuple(p.link for p in step.pictures),
+        timers=tuple(TimerRow(t.length, t.disassembly_id, t.created_at) for t in step.timers),
+        comments=tuple(CommentRow(c.text, c.save, c.created_at) for c in step.comments),
+    )
+
+def get_pack_tree(name, session=None):
+    """
+    Load a battery pack and its whole step hierarchy in 7 queries whatever the number of steps.
+    Return a PackTree (steps sorted by number) or None.
+    """
+    own_session = session is None
+    session = session or SessionLocal()
+    try:
+        pack = session.scalars(
+            select(BatteryPackModel).where(BatteryPackModel.name == name).options(*_PACK_TREE_OPTIONS)
+        ).one_or_none()
+        if pack is None:
+            return None
+        steps = sorted(pack.steps, key=lambda s: s.number)
+        return PackTree(pack.id, pack.name, pack.picture, tuple(_to_step_tree(s) for s in steps))
+    finally:
+        if own_session:
+            session.close()
+
+def list_packs(page=1, size=20, session=None):
+    """
+    One page (1-based) of packs sorted by name, with their number of steps, in a single query.
+    Return a list of PackSummary.
+    """
+    own_session = session is None
+    session = session or SessionLocal()
+    try:
+        step_count = (
+            select(StepModel.batteryPack_id, func.count(StepModel.id).label("n"))
+            .group_by(StepModel.batteryPack_id)
+            .subquery()
+        )
+        rows = session.execute(
+            select(
+                BatteryPackModel.id,
+                BatteryPackModel.name,
+                BatteryPackModel.picture,
+                func.coalesce(step_count.c.n, 0),
+            )
+            .outerjoin(step_count, step_count.c.batteryPack_id == BatteryPackModel.id)
+            .order_by(BatteryPackModel.name)
+            .limit(size)
+            .offset((page - 1) * size)
+        )
+        return [PackSummary(*row) for row in rows]
+    finally:
+        if own_session:
+            session.close()
+
+def get_pack_timing(name, session=None):
+    """
+    Estimated vs measured durations of a pack, read from the stats tables
+    maintained by the timer triggers (no aggregation over the timers here).
+    Return a PackTiming or None.
+    """
+    own_session = session is None
+    session = session or SessionLocal()
+    try:
+        pack = session.execute(
+            select(BatteryPackModel.id, BatteryPackModel.name, PackTimerStatsModel)
+            .outerjoin(PackTimerStatsModel, PackTimerStatsModel.batteryPack_id == BatteryPackModel.id)
+            .where(BatteryPackModel.name == name)
+        ).one_or_none()
+        if pack is None:
+            return None
+        pack_id, pack_name, stats = pack
+
+        rows = session.execute(
+            select(StepModel.number, StepModel.name, StepModel.time, StepTimerStatsModel)
+            .outerjoin(StepTimerStatsModel, StepTimerStatsModel.step_id == StepModel.id)
+            .where(StepModel.batteryPack_id == pack_id)
+            .order_by(StepModel.number)
+        )
+        steps = tuple(
+            StepTiming(number, step_name, time, st.count if st else 0,
+                       st.mean if st else None, st.p50 if st else None, st.p90 if st else None)
+            for number, step_name, time, st in rows
+        )
+        if stats is None:
+            return PackTiming(pack_name, sum(s.estimated_time or 0 for s in steps), None, 0, None, None, None, steps)
+        return PackTiming(
+            pack_name, stats.estimated_time, stats.measured_time, stats.disassembly_count,
+            stats.mean_total_time, stats.p50_total_time, stats.p90_total_time, steps,
+        )
+    finally:
+        if own_session:
+            session.close()
@@ -0,0 +1,282 @@
+import json
+import os
+import uuid
+import numpy as np
+import hnswlib
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+# ---------------- METADATA FILTER (chroma "where" syntax) ----------------
+def _matches(metadata: dict, where: dict) -> bool:
+    """
+    Supports {"key": value}, {"key": {"$eq" / "$ne" / "$in" / "$nin": ...}}, {"$and": [...]}, {"$or": [...]}
+    """
+    for key, cond in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, c) for c in cond):
+                return False
+        elif key == "$or":
+            if not any(_matches(metadata, c) for c in cond):
+                return False
+        elif isinstance(cond, dict):
+            (op, value), = cond.items()
+            current = metadata.get(key)
+            if not {
+                "$eq": lambda: current == value,
+                "$ne": lambda: current != value,
+                "$in": lambda: current in value,
+                "$nin": lambda: current not in value,
+            }[op]():
+                return False
+        elif metadata.get(key) != cond:
+            return False
+    return True
+
+# ---------------- IN-PROCESS ANN VECTOR STORE ----------------
+class LocalANNStore(VectorStore):
+    """
+    Vector store living in persist_directory, without any server :
+      vectors.f32   : normalised float32 embeddings, one row per chunk, memory-mapped
+      records.jsonl : append-only log, the dimension, then id, text and metadata of every row,
+                      {"deleted": row} once it is deleted
+      index.bin     : HNSW graph over the rows (inner product = cosine similarity)
+    A write appends its vectors then its records, and saves the graph once, in this order :
+    rows an interrupted run did not put in the graph are added back from the matrix on opening.
+    Opening it maps the matrix and loads the graph, nothing is re-embedded.
+    Filtered searches score the matching rows exactly from the matrix instead of the graph.
+    """
+
+    def __init__(self, embedding_function, persist_directory: str, M: int = 16, ef_construction: int = 200, ef_search: int = 64):
+        self._embedding = embedding_function
+        self.persist_directory = persist_directory
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+
+        os.makedirs(persist_directory, exist_ok=True)
+        self._vectors_path = os.path.join(persist_directory, "vectors.f32")
+        self._index_path = os.path.join(persist_directory, "index.bin")
+        self._records_path = os.path.join(persist_directory, "records.jsonl")
+
+        self._dim = None
+        self._rows = [] # the row number is the HNSW label
+        self._load_records()
+        self._row_of = {row["id"]: i for i, row in enumerate(self._rows) if row}
+        self._filter_rows = {} # rows matching each filter already used, reset on every write
+
+        self._matrix = None
+        self._index = None
+        if self._dim and self._rows:
+            self._map_matrix()
+            self._load_index()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    # ---------------- STORAGE ----------------
+    def _map_matrix(self) -> None:
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(len(self._rows), self._dim))
+
+    def _load_records(self) -> None:
+        if not os.path.exists(self._records_path):
+            return
+        complete = 0
+        with open(self._records_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break # cut by an interrupted write
+                entry = json.loads(line)
+                complete += len(line)
+                if "dim" in entry:
+                    self._dim = entry["dim"]
+                elif "deleted" in entry:
+                    self._rows[entry["deleted"]] = None
+                else:
+                    self._rows.append(entry)
+        if complete < os.path.getsize(self._records_path):
+            with open(self._records_path, "ab") as f:
+                f.truncate(complete)
+
+    def _append_records(self, entries: list[dict]) -> None:
+        with open(self._records_path, "ab") as f:
+            f.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _load_index(self) -> None:
+        """
+        Load the graph and bring it up to date with the records
+        """
+        self._index = hnswlib.Index(space="ip", dim=self._dim)
+        if os.path.exists(self._index_path):
+            self._index.load_index(self._index_path, max_elements=max(1024, len(self._rows)))
+            indexed = self._index.get_current_count()
+        else:
+            self._index.init_index(max_elements=max(1024, len(self._rows)), ef_construction=self.ef_construction, M=self.M)
+            indexed = 0
+        stale = indexed < len(self._rows)
+        if stale:
+            self._index.add_items(self._matrix[indexed:], np.arange(indexed, len(self._rows)))
+        for row, record in enumerate(self._rows):
+            if record is None:
+                try:
+                    self._index.mark_deleted(row)
+                    stale = True
+                except RuntimeError:
+                    pass # already deleted in the saved graph
+        if stale:
+            self._save_index()
+
+    def _save_index(self) -> None:
+        tmp_path = f"{self._index_path}.tmp"
+        self._index.save_index(tmp_path)
+        os.replace(tmp_path, self._index_path)
+
+    @staticmethod
+    def _normalise(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    # ---------------- WRITE ----------------
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs) -> list[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        ids = [str(i) for i in ids] if ids else [str(uuid.uuid4()) for _ in texts]
+        vectors = self._normalise(self._embedding.embed_documents(texts))
+
+        entries = []
+        if self._index is None:
+            self._dim = vectors.shape[1]
+            self._index = hnswlib.Index(space="ip", dim=self._dim)
+            self._index.init_index(max_elements=max(1024, len(texts)), ef_construction=self.ef_construction, M=self.M)
+            entries.append({"dim": self._dim})
+        start = len(self._rows)
+        if start + len(texts) > self._index.get_max_elements():
+            self._index.resize_index(max(2 * self._index.get_max_elements(), start + len(texts)))
+
+        # an id added again replaces the previous version
+        replaced = [self._row_of.pop(i) for i in dict.fromkeys(ids) if i in self._row_of]
+        entries += [{"deleted": row} for row in replaced]
+        entries += [{"id": doc_id, "text": text, "metadata": metadata} for doc_id, text, metadata in zip(ids, texts, metadatas)]
+
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(start * self._dim * 4) # drop rows written by an interrupted run
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self._append_records(entries)
+
+        for row in replaced:
+            self._rows[row] = None
+            self._index.mark_deleted(row)
+        self._index.add_items(vectors, np.arange(start, start + len(texts)))
+        for i, (doc_id, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+            self._rows.append({"id": doc_id, "text": text, "metadata": metadata})
+            self._row_of[doc_id] = start + i
+
+        self._filter_rows.clear()
+        self._map_matrix()
+        self._save_index()
+        return ids
+
+    def delete(self, ids=None, **kwargs) -> None:
+        """
+        Rows are only marked deleted : the matrix stays append-only
+        """
+        rows = [self._row_of.pop(i) for i in dict.fromkeys(ids or []) if i in self._row_of]
+        if not rows:
+            return
+        self._append_records([{"deleted": row} for row in rows])
+        for row in rows:
+            self._rows[row] = None
+            self._index.mark_deleted(row)
+        self._filter_rows.clear()
+        self._save_index()
+
+    # ---------------- READ BY ID / METADATA ----------------
+    def _document(self, row: int) -> Document:
+        record = self._rows[row]
+        return Document(id=record["id"], page_content=record["text"], metadata=record["metadata"])
+
+    def get_by_ids(self, ids, /) -> list[Document]:
+        return [self._document(self._row_of[i]) for i in ids if i in self._row_of]
+
+    def get(self, ids=None, where=None, limit=None, include=None, **kwargs) -> dict:
+        """
+        Same result shape as Chroma.get : {"ids": [...], "documents": [...], "metadatas": [...]}
+        """
+        rows = [self._row_of[i] for i in ids if i in self._row_of] if ids is not None else sorted(self._row_of.values())
+        if where:
+            rows = [r for r in rows if _matches(self._rows[r]["metadata"], where)]
+        rows = rows[:limit] if limit else rows
+        return {
+            "ids": [self._rows[r]["id"] for r in rows],
+            "documents": [self._rows[r]["text"] for r in rows],
+            "metadatas": [self._rows[r]["metadata"] for r in rows],
+        }
+
+    # ---------------- SEARCH ----------------
+    def _exact_search(self, vectors: np.ndarray, k: int, rows: list[int]) -> list[list[tuple]]:
+        if not rows:
+            return [[] for _ in vectors]
+        scores = vectors @ self._matrix[rows].T
+        k = min(k, len(rows))
+        results = []
+        for query_scores in scores:
+            top = np.argpartition(-query_scores, k - 1)[:k]
+            top = top[np.argsort(-query_scores[top])]
+            results.append([(self._document(rows[i]), float(query_scores[i])) for i in top])
+        return results
+
+    def _search(self, vectors: np.ndarray, k: int, filter: dict = None) -> list[list[tuple]]:
+        """
+        One list of (Document, cosine similarity) per query vector, best first
+        """
+        if not self._row_of:
+            return [[] for _ in vectors]
+        if filter:
+            key = json.dumps(filter, sort_keys=True)
+            if key not in self._filter_rows:
+                self._filter_rows[key] = [r for r in sorted(self._row_of.values()) if _matches(self._rows[r]["metadata"], filter)]
+            return self._exact_search(vectors, k, self._filter_rows[key])
+
+        k = min(k, len(self._row_of))
+        self._index.set_ef(max(self.ef_search, k))
+        try:
+            labels, distances = self._index.knn_query(vectors, k=k)
+        except RuntimeError:
+            # too many deleted rows for the graph to return k neighbours
+            return self._exact_search(vectors, k, sorted(self._row_of.values()))
+        return [
+            [(self._document(int(label)), 1.0 - float(distance)) for label, distance in zip(query_labels, query_distances)]
+            for query_labels, query_distances in zip(labels, distances)
+        ]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: dict = None, **kwargs) -> list[tuple]:
+        return self._search(self._normalise([self._embedding.embed_query(query)]), k, filter)[0]
+
+    def similarity_search(self, query: str, k: int = 4, filter: dict = None, **kwargs) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, filter: dict = None, **kwargs) -> list[Document]:
+        return [doc for doc, _ in self._search(self._normalise([embedding]), k, filter)[0]]
+
+    def similarity_search_batch(self, queries: list[str], k: int = 4, filter: dict = None) -> list[list[Document]]:
+        """
+        Several questions at once : one embedding call and one index query for all of them
+        """
+        vectors = self._normalise(self._embedding.embed_documents(list(queries)))
+        return [[doc for doc, _ in hits] for hits in self._search(vectors, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory: str = "./ann_db", **kwargs):
+        store = cls(embedding_function=embedding, persist_directory=persist_directory, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -0,0 +1,87 @@
+import pandas as pd
+
+PACK_COLUMN = "Battery Pack Model"
+TIME_COLUMN = "Time Estimation – Minutes"
+ROW_COLUMN = "Row"
+
+# ---------------- SPLIT THE CSV IN ROW BATCHES ----------------
+def split_csv_batches(df: pd.DataFrame, max_rows: int = 20, pack_column: str = PACK_COLUMN) -> list[str]:
+    """
+    Return the CSV text of each batch (header included).
+    Rows are grouped by battery pack (in order of first appearance),
+    then each pack is cut in batches of at most max_rows rows.
+    """
+    batches = []
+    packs = df[pack_column].fillna("") if pack_column in df.columns else pd.Series("", index=df.index)
+    for _, group in df.groupby(packs, sort=False):
+        for start in range(0, len(group), max_rows):
+            batches.append(group.iloc[start:start + max_rows].to_csv(index=False))
+    return batches
+
+# ---------------- MERGE THE PARTIAL ANSWERS ----------------
+def merge_battery_packs(partials: list[dict]) -> dict:
+    """
+    Merge several {"batteryPacks": [...]} answers into one.
+    Packs with the same name are merged, their steps are sorted by number
+    and a step number seen twice keeps its first occurrence.
+    """
+    packs = {}
+    for partial in partials:
+        for pack in partial.get("batteryPacks", []):
+            merged = packs.setdefault(pack["name"], {**pack, "steps": []})
+            if not merged.get("picture") and pack.get("picture"):
+                merged["picture"] = pack["picture"]
+            merged["steps"].extend(pack.get("steps", []))
+
+    for pack in packs.values():
+        steps = {}
+        for step in pack["steps"]:
+            steps.setdefault(step.get("number"), step)
+        pack["steps"] = sorted(steps.values(), key=lambda s: (s.get("number") is None, s.get("number") or 0))
+
+    return {"batteryPacks": list(packs.values())}
+
+# ---------------- FIELDS READ STRAIGHT FROM THE COLUMNS ----------------
+def structured_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Pack, step number, name, duration and tools of every row, without any LLM call
+    """
+    out = pd.DataFrame(index=df.index)
+    out["pack"] = df[PACK_COLUMN].fillna("").astype(str).str.strip()
+    out["number"] = pd.to_numeric(df["Step Number"], errors="coerce")
+    out["name"] = df["Title"].fillna("").astype(str).str.strip()
+    out["time"] = pd.to_numeric(df[TIME_COLUMN], errors="coerce")
+    out["tools"] = (
+        df["Tools"].fillna("").astype(str)
+        .str.split(r"[,;\n]+")
+        .map(lambda names: [{"name": n.strip()} for n in names if n.strip()])
+    )
+    return out[out["number"].notna()]
+
+def free_text_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Only the columns the LLM still has to read, with the row index to join the answers back
+    """
+    out = df[["Description", "Identified Risk"]].copy()
+    out.insert(0, ROW_COLUMN, df.index)
+    return out
+
+# ---------------- ASSEMBLE THE HYBRID ANSWER ----------------
+def assemble_hybrid(structured: pd.DataFrame, free_text_rows: dict) -> dict:
+    """
+    structured     : output of structured_columns
+    free_text_rows : {row index: {"sub_steps": [...], "risks": "..."}} from the LLM
+    Return the same {"batteryPacks": [...]} as the full LLM extraction
+    """
+    packs = {}
+    for row, rec in zip(structured.index, structured.to_dict("records")):
+        extra = free_text_rows.get(row, {})
+        packs.setdefault(rec["pack"], []).append({
+            "name": rec["name"],
+            "number": int(rec["number"]),
+            "time": None if pd.isna(rec["time"]) else float(rec["time"]),
+            "risks": extra.get("risks"),
+            "sub_steps": extra.get("sub_steps") or [],
+            "tools": rec["tools"],
+        })
+    return merge_battery_packs([{"batteryPacks": [{"name": name, "steps": steps} for name, steps in packs.items()]}])
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# ---------------- HTTP SESSION ----------------
+def make_session(pool_size: int = 8, retries: int = 3, backoff_factor: float = 0.5) -> requests.Session:
+    """
+    Session with a connection pool shared by all the download threads
+    and retries with exponential backoff on connection errors / 429 / 5xx
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# ---------------- DOWNLOAD ONE IMAGE ----------------
+def image_path(url: str, prefix: str, output_dir: str = "images") -> str:
+    """
+    Local path of an image, named after the hash of its URL
+    so an image already downloaded is found again on the next run
+    """
+    ext = os.path.splitext(urlparse(url).path)[1] or ".jpg"
+    url_hash = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(output_dir, f"{prefix}_{url_hash}{ext}")
+
+def download_image(session: requests.Session, url: str, path: str, timeout: float = 10, chunk_size: int = 1 << 16) -> str:
+    """
+    Stream the image to disk (tmp file then rename, the final file only exists once complete)
+    Skip the request if the file is already there
+    The tmp file name is unique, two downloads of the same path never write to the same file
+    """
+    if os.path.exists(path):
+        return path
+
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+    try:
+        with session.get(url, timeout=timeout, stream=True) as r:
+            r.raise_for_status()
+            with open(tmp_path, "wb") as f:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+# ---------------- DOWNLOAD ALL IMAGES ----------------
+def download_images(images_map: dict, prefix: str, output_dir: str = "images", workers: int = 8, retries: int = 3, timeout: float = 10) -> dict:
+    """
+    images_map : {step number: [urls...]}
+    Return {step number: [local paths...]} in the same order as the urls,
+    failed downloads are printed and left out
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    session = make_session(pool_size=workers, retries=retries)
+
+    jobs = [
+        (step_num, url, image_path(url, f"{prefix}_step_{step_num}", output_dir))
+        for step_num, urls in images_map.items()
+        for url in urls
+    ]
+    local_images = {step_num: [] for step_num in images_map}
+
+    with session, ThreadPoolExecutor(max_workers=workers) as pool:
+        # a url repeated in images_map is downloaded once, all its jobs share the result
+        futures = {}
+        for _, url, path in jobs:
+            if path not in futures:
+                futures[path] = pool.submit(download_image, session, url, path, timeout)
+        for step_num, url, path in jobs:
+            try:
+                local_images[step_num].append(futures[path].result())
+            except Exception as e:
+                print(f"Error while downloading {url}: {e}")
+
+    return local_images
@@ -0,0 +1,218 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import cached_property
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
+
+EMBEDDING_CACHE_PATH = "./embedding_cache.sqlite"
+
+# ---------------- EMBEDDINGS WITH A PERSISTENT CACHE ----------------
+class CachedEmbeddings(Embeddings):
+    """
+    Wrap an embedding model with an on-disk SQLite cache
+    keyed by sha256(model name + chunk text), shared by every script
+    """
+
+    def __init__(self, underlying: Embeddings, cache_path: str = EMBEDDING_CACHE_PATH):
+        self.underlying = underlying
+        self.model_name = getattr(underlying, "model", None) or type(underlying).__name__
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\n{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: list[str]) -> dict:
+        found = {}
+        with self._lock:
+            # sqlite limits the number of "?" per statement
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                )
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def _store(self, items: dict) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items.items()],
+            )
+            self._conn.commit()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [self._key(t) for t in texts]
+        vectors = self._lookup(list(set(keys)))
+
+        # embed each missing text once, even if it appears several times
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            new_vectors = dict(zip(missing, self.underlying.embed_documents(list(missing.values()))))
+            self._store(new_vectors)
+            vectors.update(new_vectors)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        key = self._key(text)
+        found = self._lookup([key])
+        if key in found:
+            self.hits += 1
+            return found[key]
+        self.misses += 1
+        vector = self.underlying.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0.0
+        return f"{self.hits} hits / {self.misses} misses ({rate:.1f}% servis par le cache)"
+
+# ---------------- BATCHED EMBEDDING STAGE ----------------
+def estimate_tokens(text: str) -> int:
+    """
+    Upper estimate of the token count (about 3 characters per token), no tokenizer needed
+    """
+    return len(text) // 3 + 1
+
+def batch_by_tokens(texts: list[str], max_tokens: int = 100_000, max_items: int = 1000) -> list[list[int]]:
+    """
+    Cut the texts in consecutive batches of at most max_tokens (estimated) and max_items texts
+    Return the indices of the texts of each batch
+    """
+    batches, current, current_tokens = [], [], 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (current_tokens + tokens > max_tokens or len(current) == max_items):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def embed_in_batches(embeddings: Embeddings, texts: list[str], max_tokens: int = 100_000, concurrency: int = 4, max_items: int = 1000) -> list[list[float]]:
+    """
+    Embed the texts by batches of at most max_tokens, `concurrency` batches at the same time,
+    and print the progress in chunks/s. Return the vectors in the order of texts.
+    With CachedEmbeddings each finished batch is written to the cache right away :
+    an interrupted run starts again from the batches not done yet.
+    A failing batch is split in two and retried, down to a single text.
+    """
+    def embed(indices):
+        try:
+            return embeddings.embed_documents([texts[i] for i in indices])
+        except Exception as e:
+            if len(indices) == 1:
+                raise
+            print(f"⚠️ Batch de {len(indices)} chunks en échec ({e}), découpé en deux")
+            half = len(indices) // 2
+            return embed(indices[:half]) + embed(indices[half:])
+
+    batches = batch_by_tokens(texts, max_tokens=max_tokens, max_items=max_items)
+    vectors = [None] * len(texts)
+    done, start = 0, time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {pool.submit(embed, batch): batch for batch in batches}
+        for n, future in enumerate(as_completed(futures), 1):
+            batch = futures[future]
+            for i, vector in zip(batch, future.result()):
+                vectors[i] = vector
+            done += len(batch)
+            rate = done / max(time.perf_counter() - start, 1e-9)
+            print(f"🧮 Batch {n}/{len(batches)} : {done}/{len(texts)} chunks ({rate:.1f} chunks/s)")
+    return vectors
+
+# ---------------- LOCAL CPU EMBEDDINGS ----------------
+class _CPUMiniLM(ONNXMiniLM_L6_V2):
+    """
+    ONNX all-MiniLM-L6-v2 shipped with chromadb, on the CPU with a fixed number of threads per call
+    """
+
+    def __init__(self, intra_op_threads: int):
+        super().__init__(preferred_providers=["CPUExecutionProvider"])
+        self.intra_op_threads = intra_op_threads
+
+    @cached_property
+    def model(self):
+        options = self.ort.SessionOptions()
+        options.log_severity_level = 3
+        options.intra_op_num_threads = self.intra_op_threads
+        return self.ort.InferenceSession(
+            os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME, "model.onnx"),
+            providers=["CPUExecutionProvider"],
+            sess_options=options,
+        )
+
+class LocalEmbeddings(Embeddings):
+    """
+    Sentence embeddings (all-MiniLM-L6-v2, 384 dimensions) computed on the CPU with onnxruntime,
+    no API call : the model is downloaded once to ~/.cache/chroma/onnx_models, then runs offline.
+    Texts are embedded by batches of batch_size, `workers` batches at the same time
+    (tokenizing one batch while another runs) : each worker has its own ONNX session
+    running on its share of the CPU cores.
+    """
+
+    model = "all-MiniLM-L6-v2" # part of the cache key
+
+    def __init__(self, batch_size: int = 32, workers: int = None):
+        cpus = os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.workers = workers or min(4, cpus)
+        self._models = [_CPUMiniLM(intra_op_threads=max(1, cpus // self.workers)) for _ in range(self.workers)]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        # the first batch alone : downloads the model once, before the threads
+        results = [self._models[0](batches[0])] + [None] * (len(batches) - 1)
+
+        def run(worker):
+            # worker w embeds the batches w+1, w+1+workers, ... with its own session
+            for i in range(1 + worker, len(batches), self.workers):
+                results[i] = self._models[worker](batches[i])
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            list(pool.map(run, range(self.workers)))
+        return [vector.tolist() for batch in results for vector in batch]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+# ---------------- DEFAULT EMBEDDINGS ----------------
+def get_embeddings(cache_path: str = EMBEDDING_CACHE_PATH, provider: str = None) -> CachedEmbeddings:
+    """
+    provider : "openai" (default) or "local" (LocalEmbeddings, offline on the CPU)
+    Read from EMBEDDING_PROVIDER when not given.
+    """
+    provider = provider or os.getenv("EMBEDDING_PROVIDER", "openai")
+    if provider == "openai":
+        return CachedEmbeddings(OpenAIEmbeddings(), cache_path=cache_path)
+    if provider == "local":
+        return CachedEmbeddings(LocalEmbeddings(), cache_path=cache_path)
+    raise ValueError(f"unknown embedding provider : {provider}")
@@ -1,13 +1,91 @@
 import fitz
+import hashlib
+import io
 import os
 import uuid
 import re
+from PIL import Image
+
+# stream formats that can be written to disk without any conversion
+RAW_IMAGE_EXTS = {"jpeg", "jpg", "png"}
+
+# ---------------- CONTENT-HASHED IMAGE STORE ----------------
+def _image_key(doc: fitz.Document, xref: int, max_dimension: int = None) -> str:
+    """
+    sha256 of the raw stream of the image xref : the same picture gets the same name
+    in every PDF and on every run. The downscale size is part of the name.
+    """
+    raw = doc.xref_stream_raw(xref) or doc.extract_image(xref)["image"]
+    digest = hashlib.sha256(raw).hexdigest()
+    return f"{digest}_{max_dimension}" if max_dimension else digest
+
+def _write_once(out_path: str, write) -> str:
+    """
+    Call write(tmp_path) only if out_path does not exist yet, then rename the tmp file
+    (several worker processes may save the same image at the same time)
+    """
+    if os.path.exists(out_path):
+        return out_path
+    root, ext = os.path.splitext(out_path)
+    tmp_path = f"{root}.{uuid.uuid4().hex}.tmp{ext}"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return out_path
+
+# ---------------- SAVE ONE IMAGE ----------------
+def _save_image(doc: fitz.Document, xref: int, output_dir: str, keep_original: bool = False, max_dimension: int = None) -> str:
+    """
+    Write the image xref in output_dir (named after its content, skipped if already there) and return its path.
+    keep_original : write the embedded stream as-is (no decode / PNG re-encode)
+                    when it is a plain RGB / gray JPEG or PNG without soft mask
+    max_dimension : downscale the image so its largest side is at most max_dimension pixels
+    """
+    fname = _image_key(doc, xref, max_dimension)
+
+    if keep_original:
+        info = doc.extract_image(xref)
+        if info and info["ext"] in RAW_IMAGE_EXTS and not info["smask"] and info["colorspace"] in (1, 3):
+            ext = info["ext"]
+
+            def write_raw(path):
+                data = info["image"]
+                if max_dimension and max(info["width"], info["height"]) > max_dimension:
+                    img = Image.open(io.BytesIO(data))
+                    img.thumbnail((max_dimension, max_dimension))
+                    buffer = io.BytesIO()
+                    img.save(buffer, format="PNG" if ext == "png" else "JPEG", quality=85)
+                    data = buffer.getvalue()
+                with open(path, "wb") as f:
+                    f.write(data)
+
+            return _write_once(os.path.join(output_dir, f"{fname}.{ext}"), write_raw)
+
+    # fallback : decode the image and save it as PNG
+    def write_png(path):
+        pix = fitz.Pixmap(doc, xref)
+        if pix.n - pix.alpha >= 4:  # CMYK cannot be written as PNG
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+        if max_dimension:
+            # shrink by powers of 2 until the largest side fits
+            factor = 0
+            while max(pix.width, pix.height) >> factor > max_dimension:
+                factor += 1
+            if factor:
+                pix.shrink(factor)
+        pix.save(path)
+
+    return _write_once(os.path.join(output_dir, f"{fname}.png"), write_png)
 
 # ---------------- EXTRACT IMAGE IGNORING HEADER & FOOTER ----------------
-def _extract_images_from_page(page: fitz.Page, output_dir: str, header_margin_ratio: float, y_start: float = None, y_end: float = None) -> list[str]:
+def _extract_images_from_page(page: fitz.Page, output_dir: str, header_margin_ratio: float, y_start: float = None, y_end: float = None, **image_opts) -> list[str]:
     """
     Extract images from a specific vertical range of the page
     y_start and y_end are optional vertical coordinates to limit the image extraction area
+    image_opts are passed to _save_image (keep_original, max_dimension)
     """
     height = page.rect.height
     images = []
@@ -26,76 +104,69 @@ def _extract_images_from_page(page: fitz.Page, output_dir: str, header_margin_ra
             if y0 < y_start or y1 > y_end:
                 continue
 
-        pix = fitz.Pixmap(page.parent, xref)
-        fname = f"{uuid.uuid4()}.png"
-        out_path = os.path.join(output_dir, fname)
-        pix.save(out_path)
-        pix = None
-        images.append(out_path)
+        images.append(_save_image(page.parent, xref, output_dir, **image_opts))
 
     return images
 
-# ---------------- EXTRACT STEPS IMAGES ----------------
-def extract_step_images(pdf_path: str, output_dir: str = "images/", header_margin_ratio: float = 0.2) -> dict:
+# ----------------  REGEX TO DETECT STEPS & THE END OF THE STEPS LIST ----------------
+step_re = re.compile(r"^Step\s+(\d+):", re.MULTILINE)
+nextSection_re = re.compile(r"^Section\s+\d+:", re.MULTILINE)
+
+# ---------------- READ THE LINES OF A PAGE WITH THEIR POSITION ----------------
+def _read_page_lines(page: fitz.Page) -> list[tuple[str, float]]:
     """
-    Return a dict :
-      {
-        "step_images": {
-           "Step 0": [paths...],
-           "Step 1": [...],
-           ...
-        }
-      }
+    Return [(line text, y0 of the line), ...] in reading order,
+    from a single layout extraction of the page (images excluded)
     """
-    os.makedirs(output_dir, exist_ok=True)
-    doc = fitz.open(pdf_path)
-    result = {"step_images": {}}
-    
-    # ----------------  REGEX TO DETECT STEPS & THE END OF THE STEPS LIST ----------------
-    step_re = re.compile(r"^Step\s+(\d+):", re.MULTILINE)
-    nextSection_re = re.compile(r"^Section\s+\d+:", re.MULTILINE)
-
-    # First pass: identify all steps and their vertical positions
-    steps_content = {}  # {step_num: {"start_page": X, "start_y": Y, "end_page": Z, "end_y": W}}
+    lines = []
+    for block in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:
+        for line in block.get("lines", []):
+            text = "".join(span["text"] for span in line["spans"])
+            lines.append((text, line["bbox"][1]))
+    return lines
+
+def _lines_to_text(lines: list[tuple[str, float]]) -> str:
+    """
+    Same output as page.get_text("text"), rebuilt from the positioned lines
+    """
+    return "".join(f"{text}\n" for text, _ in lines)
+
+# ---------------- FIND STEPS POSITIONS ----------------
+def _find_step_boundaries(doc: fitz.Document, page_lines: list[list[tuple[str, float]]]) -> dict:
+    """
+    Identify all steps and their vertical positions in one linear pass over the positioned lines
+    Return {step_name: {"start_page": X, "start_y": Y, "end_page": Z, "end_y": W}}
+    """
+    steps_content = {}
     current_step = None
-    current_step_start_y = None
-    
-    for page_index in range(len(doc)):
-        page = doc.load_page(page_index)
-        text = page.get_text("text")
-        lines = text.splitlines()
+
+    for page_index, lines in enumerate(page_lines):
 
         # a) DETECT NEW STEP OR END OF THE RECIPE
-        for line in lines:
+        for line, y_pos in lines:
             stripped = line.strip()
             m_step = step_re.match(stripped)
             if m_step:
                 num = int(m_step.group(1))
-                # Get the vertical position of this step
-                text_instances = page.search_for(stripped)
-                if text_instances:
-                    y_pos = text_instances[0].y0  # y0 is the top coordinate
-                    
-                    # If we had a previous step, set its end position
-                    if current_step:
-                        steps_content[current_step]["end_page"] = page_index
-                        steps_content[current_step]["end_y"] = y_pos
-                    
-                    current_step = f"Step {num}"
-                    print(f"🔄 Nouveau step détecté: {current_step} (ligne: {repr(line)})")
-                    steps_content[current_step] = {
-                        "start_page": page_index,
-                        "start_y": y_pos
-                    }
+
+                # If we had a previous step, set its end position
+                if current_step:
+                    steps_content[current_step]["end_page"] = page_index
+                    steps_content[current_step]["end_y"] = y_pos
+
+                current_step = f"Step {num}"
+                print(f"🔄 Nouveau step détecté: {current_step} (ligne: {repr(line)})")
+                steps_content[current_step] = {
+                    "start_page": page_index,
+                    "start_y": y_pos
+                }
 
             if nextSection_re.match(stripped):
                 print(f"⏹️  Fin de la recette détectée: '{stripped}'")
                 if current_step:
                     steps_content[current_step]["end_page"] = page_index
-                    # Get the vertical position of the section header
-                    text_instances = page.search_for(stripped)
-                    if text_instances:
-                        steps_content[current_step]["end_y"] = text_instances[0].y0
+                    # the section header position is the end of the step
+                    steps_content[current_step]["end_y"] = y_pos
                 break
 
     # Set end position for the last step if not set
@@ -103,21 +174,30 @@ def extract_step_images(pdf_path: str, output_dir: str = "images/", header_margi
         steps_content[current_step]["end_page"] = len(doc) - 1
         steps_content[current_step]["end_y"] = doc[-1].rect.height
 
-    # Second pass: extract images for each step using their vertical positions
+    return steps_content
+
+# ---------------- EXTRACT IMAGES OF EACH STEP ----------------
+def _extract_images_by_step(doc: fitz.Document, steps_content: dict, output_dir: str, header_margin_ratio: float, **image_opts) -> dict:
+    """
+    Extract images for each step using their vertical positions
+    Return {step_name: [paths...]}
+    """
+    step_images = {}
     for step, content in steps_content.items():
-        result["step_images"][step] = []
-        
+        step_images[step] = []
+
         # Handle single page case
         if content["start_page"] == content["end_page"]:
             page = doc.load_page(content["start_page"])
             images = _extract_images_from_page(
-                page, 
-                output_dir, 
+                page,
+                output_dir,
                 header_margin_ratio,
                 content["start_y"],
-                content["end_y"]
+                content["end_y"],
+                **image_opts
             )
-            result["step_images"][step].extend(images)
+            step_images[step].extend(images)
         else:
             # Handle first page
             page = doc.load_page(content["start_page"])
@@ -126,20 +206,22 @@ def extract_step_images(pdf_path: str, output_dir: str = "images/", header_margi
                 output_dir,
                 header_margin_ratio,
                 content["start_y"],
-                page.rect.height
+                page.rect.height,
+                **image_opts
             )
-            result["step_images"][step].extend(images)
-            
+            step_images[step].extend(images)
+
             # Handle middle pages if any
             for page_index in range(content["start_page"] + 1, content["end_page"]):
                 page = doc.load_page(page_index)
                 images = _extract_images_from_page(
                     page,
                     output_dir,
-                    header_margin_ratio
+                    header_margin_ratio,
+                    **image_opts
                 )
-                result["step_images"][step].extend(images)
-            
+                step_images[step].extend(images)
+
             # Handle last page
             if content["end_page"] > content["start_page"]:
                 page = doc.load_page(content["end_page"])
@@ -148,29 +230,81 @@ def extract_step_images(pdf_path: str, output_dir: str = "images/", header_margi
                     output_dir,
                     header_margin_ratio,
                     0,
-                    content["end_y"]
+                    content["end_y"],
+                    **image_opts
                 )
-                result["step_images"][step].extend(images)
+                step_images[step].extend(images)
 
-    return result
+    return step_images
+
+# ---------------- EXTRACT MAIN IMAGE FROM AN OPEN DOC ----------------
+def _extract_main_image(doc: fitz.Document, output_dir: str, header_margin_ratio: float, **image_opts) -> str:
+    if len(doc) < 2:
+        return ""
+
+    page = doc.load_page(1)  # index 1 = page 2
+
+    # FETCH ALL IMAGES EXCEPT HEADER & FOOTER
+    imgs = _extract_images_from_page(page, output_dir, header_margin_ratio, **image_opts)
+    return imgs[0] if imgs else ""
+
+# ---------------- EXTRACT STEPS IMAGES ----------------
+def extract_step_images(pdf_path: str, output_dir: str = "images/", header_margin_ratio: float = 0.2, keep_original: bool = False, max_dimension: int = None) -> dict:
+    """
+    Return a dict :
+      {
+        "step_images": {
+           "Step 0": [paths...],
+           "Step 1": [...],
+           ...
+        }
+      }
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with fitz.open(pdf_path) as doc:
+        page_lines = [_read_page_lines(page) for page in doc]
+        steps_content = _find_step_boundaries(doc, page_lines)
+        step_images = _extract_images_by_step(
+            doc, steps_content, output_dir, header_margin_ratio,
+            keep_original=keep_original, max_dimension=max_dimension
+        )
+        return {"step_images": step_images}
 
 # ---------------- EXTRACT MAIN IMAGE - PAGE 2 ----------------
 def extract_main_image(
     pdf_path: str,
     output_dir: str = "images/",
-    header_margin_ratio: float = 0.2
+    header_margin_ratio: float = 0.2,
+    keep_original: bool = False,
+    max_dimension: int = None
 ) -> str:
     """
     Extract the first image from page 2.
     Return the path or ""
     """
-    doc = fitz.open(pdf_path)
+    with fitz.open(pdf_path) as doc:
+        return _extract_main_image(doc, output_dir, header_margin_ratio, keep_original=keep_original, max_dimension=max_dimension)
 
-    if len(doc) < 2:
-        return ""
-
-    page = doc.load_page(1)  # index 1 = page 2
-
-    # FETCH ALL IMAGES EXCEPT HEADER & FOOTER 
-    imgs = _extract_images_from_page(page, output_dir, header_margin_ratio)
-    return imgs[0] if imgs else ""
\ No newline at end of file
+# ---------------- PARSE A PDF IN ONE PASS ----------------
+def parse_pdf_document(pdf_path: str, output_dir: str = "images/", header_margin_ratio: float = 0.2, keep_original: bool = False, max_dimension: int = None) -> dict:
+    """
+    Open the PDF once and return everything the ingestion needs :
+      {
+        "page_texts": [text of page 1, ...],
+        "steps": {"Step 1": {"start_page": ..., "start_y": ..., "end_page": ..., "end_y": ...}, ...},
+        "main_image": path or "",
+        "step_images": {"Step 1": [paths...], ...}
+      }
+    keep_original / max_dimension : see _save_image
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with fitz.open(pdf_path) as doc:
+        image_opts = {"keep_original": keep_original, "max_dimension": max_dimension}
+        page_lines = [_read_page_lines(page) for page in doc]
+        steps_content = _find_step_boundaries(doc, page_lines)
+        return {
+            "page_texts": [_lines_to_text(lines) for lines in page_lines],
+            "steps": steps_content,
+            "main_image": _extract_main_image(doc, output_dir, header_margin_ratio, **image_opts),
+            "step_images": _extract_images_by_step(doc, steps_content, output_dir, header_margin_ratio, **image_opts),
+        }
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+from glob import glob
+
+# ---------------- LIST PDF FILES ----------------
+def list_pdfs(path: str, pattern: str = "**/*.pdf") -> list[str]:
+    """
+    Return every PDF under path, normalised and sorted
+    so the keys match the "source" metadata of the loaded docs
+    """
+    return sorted(os.path.normpath(p) for p in glob(os.path.join(path, pattern), recursive=True))
+
+# ---------------- HASH A FILE ----------------
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """
+    Hash the content of a file by blocks (no full read in memory)
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+# ---------------- LOAD & SAVE MANIFEST ----------------
+def load_manifest(manifest_path: str) -> dict:
+    """
+    Return the manifest :
+      {
+        "docs/pack.pdf": {"sha256": ..., "mtime": ..., "size": ..., "chunk_ids": [...]},
+        ...
+      }
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(manifest: dict, manifest_path: str) -> None:
+    """
+    Write the manifest atomically so an interrupted run never leaves it half written
+    """
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+# ---------------- COMPARE FILES WITH MANIFEST ----------------
+def diff_manifest(manifest: dict, pdf_files: list[str]) -> dict:
+    """
+    Return a dict :
+      {
+        "new":       {path: file_info, ...},
+        "modified":  {path: file_info, ...},
+        "unchanged": [paths...],
+        "deleted":   [paths...]
+      }
+    A file whose size and mtime did not move is skipped without being read.
+    A touched file whose content hash is identical only gets its mtime refreshed.
+    """
+    changes = {"new": {}, "modified": {}, "unchanged": [], "deleted": []}
+
+    for pdf in pdf_files:
+        stat = os.stat(pdf)
+        entry = manifest.get(pdf)
+
+        # same size & mtime -> unchanged, no hashing needed
+        if entry and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            changes["unchanged"].append(pdf)
+            continue
+
+        info = {"sha256": file_sha256(pdf), "mtime": stat.st_mtime_ns, "size": stat.st_size}
+        if entry is None:
+            changes["new"][pdf] = info
+        elif entry["sha256"] != info["sha256"]:
+            changes["modified"][pdf] = info
+        else:
+            entry["mtime"] = info["mtime"]
+            changes["unchanged"].append(pdf)
+
+    changes["deleted"] = sorted(set(manifest) - set(pdf_files))
+    return changes
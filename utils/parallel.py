@@ -0,0 +1,17 @@
+from concurrent.futures import ProcessPoolExecutor
+
+# ---------------- MAP A FUNCTION OVER PDF FILES ----------------
+def map_pdfs(func, pdf_files: list[str], workers: int = 1):
+    """
+    Yield func(pdf) for every PDF, in the order of pdf_files.
+    With workers > 1 the PDFs are processed by a process pool,
+    func must then be a module level function (picklable).
+    """
+    if workers <= 1 or len(pdf_files) <= 1:
+        for pdf in pdf_files:
+            yield func(pdf)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(pdf_files))) as pool:
+        # pool.map keeps the input order whatever the completion order
+        yield from pool.map(func, pdf_files)
@@ -0,0 +1,90 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+RESULTS_PATH = "./results/answers.jsonl"
+
+# ---------------- INDEX OF THE RESULTS FILE ----------------
+def _index_path(path: str) -> str:
+    return f"{os.path.splitext(path)[0]}.index.sqlite"
+
+def _connect_index(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(_index_path(path))
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS answers ("
+        "id TEXT PRIMARY KEY, source TEXT, created_at REAL NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_answers_source_created_at ON answers (source, created_at)")
+    return conn
+
+# ---------------- APPEND ONE ANSWER ----------------
+def append_result(answer_text: str, source: str = None, path: str = RESULTS_PATH, created_at: float = None) -> str:
+    """
+    Append the answer as one JSON line and index its position by id and source.
+    The file is only ever appended to. Return the id of the record.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    try:
+        answer = json.loads(answer_text)
+    except json.JSONDecodeError:
+        answer = answer_text # kept as text so nothing is lost
+    record = {
+        "id": str(uuid.uuid4()),
+        "source": source,
+        "created_at": time.time() if created_at is None else created_at,
+        "answer": answer,
+    }
+    line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+    with open(path, "ab") as f:
+        offset = f.tell()
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+    conn = _connect_index(path)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO answers (id, source, created_at, offset, length) VALUES (?, ?, ?, ?, ?)",
+                (record["id"], source, record["created_at"], offset, len(line)),
+            )
+    finally:
+        conn.close()
+    return record["id"]
+
+# ---------------- READ ANSWERS BACK ----------------
+def _read_at(path: str, offset: int, length: int) -> dict:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return json.loads(f.read(length))
+
+def read_result(result_id: str, path: str = RESULTS_PATH):
+    """
+    Return the record {"id", "source", "created_at", "answer"} or None
+    """
+    if not os.path.exists(path):
+        return None
+    conn = _connect_index(path)
+    try:
+        row = conn.execute("SELECT offset, length FROM answers WHERE id = ?", (result_id,)).fetchone()
+    finally:
+        conn.close()
+    return _read_at(path, *row) if row else None
+
+def latest_result(source: str = None, path: str = RESULTS_PATH):
+    """
+    Most recent record of a source (None : answers over the whole store), or None
+    """
+    if not os.path.exists(path):
+        return None
+    conn = _connect_index(path)
+    try:
+        row = conn.execute(
+            "SELECT offset, length FROM answers WHERE source IS ? ORDER BY created_at DESC LIMIT 1", (source,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return _read_at(path, *row) if row else None
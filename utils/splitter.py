@@ -0,0 +1,54 @@
+import os
+import re
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from utils.images import step_re, nextSection_re
+
+# ---------------- SPLIT TEXT ON STEP & SECTION TITLES ----------------
+def _split_sections(text: str) -> list[tuple[dict, str]]:
+    """
+    Cut the text before every "Step N:" or "Section N:" line
+    Return [(metadata of the part, text of the part), ...]
+    """
+    parts = []
+    current_meta, current_lines = {}, []
+
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        m_step = step_re.match(stripped)
+        m_section = nextSection_re.match(stripped)
+        if m_step or m_section:
+            if "".join(current_lines).strip():
+                parts.append((current_meta, "".join(current_lines)))
+            current_meta = {"step": int(m_step.group(1))} if m_step else {"section": int(re.search(r"\d+", stripped).group())}
+            current_lines = []
+        current_lines.append(line)
+
+    if "".join(current_lines).strip():
+        parts.append((current_meta, "".join(current_lines)))
+    return parts
+
+# ---------------- STEP AWARE SPLITTER ----------------
+def split_by_steps(docs: list[Document], max_chunk_size: int = 2000, chunk_overlap: int = 100) -> list[Document]:
+    """
+    One chunk per step (or section), with the step number and the pack in the metadata.
+    Only steps longer than max_chunk_size are split again by size.
+    """
+    fallback = RecursiveCharacterTextSplitter(chunk_size=max_chunk_size, chunk_overlap=chunk_overlap)
+    chunks = []
+
+    for doc in docs:
+        source = doc.metadata.get("source", "")
+        pack = os.path.splitext(os.path.basename(source))[0]
+
+        for part_meta, part_text in _split_sections(doc.page_content):
+            metadata = {**doc.metadata, "pack": pack, **part_meta}
+            if len(part_text) <= max_chunk_size:
+                chunks.append(Document(page_content=part_text.strip(), metadata=metadata))
+            else:
+                chunks.extend(
+                    Document(page_content=piece, metadata=dict(metadata))
+                    for piece in fallback.split_text(part_text)
+                )
+
+    return chunks
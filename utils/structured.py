@@ -0,0 +1,154 @@
+import json
+from typing import Optional, Union, get_args, get_origin
+from pydantic import BaseModel, ValidationError, create_model
+from langchain_core.messages import HumanMessage, convert_to_messages
+
+REPAIR_TEMPLATE = """These JSON objects are parts of your answer to the request above.
+Fix each of them so it matches the expected schema, using the context of the request,
+and return it under the same key.
+Keep every value that is already correct unchanged, only fix the reported errors.
+
+{fragments}
+"""
+
+FRAGMENT_TEMPLATE = """{key}
+Validation errors:
+{errors}
+JSON:
+{fragment}
+"""
+
+# ---------------- READ THE RAW ANSWER ----------------
+def _raw_payload(raw) -> Optional[dict]:
+    """
+    Arguments of the tool call (or JSON content) of the raw model message, None if unreadable
+    """
+    calls = list(getattr(raw, "tool_calls", None) or [])
+    if calls:
+        return calls[0]["args"]
+    for call in getattr(raw, "invalid_tool_calls", None) or []:
+        try:
+            return json.loads(call["args"])
+        except (TypeError, json.JSONDecodeError):
+            continue
+    try:
+        return json.loads(raw.content)
+    except (AttributeError, TypeError, json.JSONDecodeError):
+        return None
+
+def _as_messages(messages) -> list:
+    """
+    Messages of a prompt value, a string or a list of messages
+    """
+    if hasattr(messages, "to_messages"):
+        return messages.to_messages()
+    if isinstance(messages, str):
+        return [HumanMessage(messages)]
+    return convert_to_messages(messages)
+
+# ---------------- LOCATE THE INVALID PART ----------------
+def _fragment_path(loc: tuple) -> tuple:
+    """
+    Path of the smallest list item containing the error :
+      ("batteryPacks", 0, "steps", 3, "time") -> ("batteryPacks", 0, "steps", 3)
+    """
+    for i in range(len(loc) - 1, -1, -1):
+        if isinstance(loc[i], int):
+            return tuple(loc[:i + 1])
+    return ()
+
+def _model_at(schema: type[BaseModel], path: tuple) -> type[BaseModel]:
+    """
+    Pydantic model of the object found at path (List / Optional unwrapped)
+    """
+    model = schema
+    for part in path:
+        if isinstance(part, int):
+            continue
+        annotation = model.model_fields[part].annotation
+        while get_origin(annotation) in (list, Union, Optional):
+            annotation = next(a for a in get_args(annotation) if a is not type(None))
+        model = annotation
+    return model
+
+def _get(payload, path: tuple):
+    for part in path:
+        payload = payload[part]
+    return payload
+
+def _set(payload, path: tuple, value):
+    if not path:
+        return value
+    _get(payload, path[:-1])[path[-1]] = value
+    return payload
+
+# ---------------- REPAIR ONLY THE INVALID PARTS ----------------
+async def _repair(llm, messages, schema: type[BaseModel], payload, error: ValidationError, retry_exceptions: tuple):
+    """
+    messages : the original request, sent again so the model can fix the values from the source text
+    """
+    errors_by_path = {}
+    for err in error.errors():
+        path = _fragment_path(err["loc"])
+        # a path that does not exist in the payload (e.g. bad list) : repair its parent
+        while path:
+            try:
+                _get(payload, path)
+                break
+            except (KeyError, IndexError, TypeError):
+                path = _fragment_path(path[:-1])
+        errors_by_path.setdefault(path, []).append(f"{'.'.join(map(str, err['loc']))}: {err['msg']}")
+
+    # an object inside another invalid object is repaired with it (e.g. a step of an invalid pack) :
+    # the repaired parent may not have the same items any more
+    fragments = {}
+    for path in sorted(errors_by_path, key=len):
+        parent = next((p for p in fragments if path[:len(p)] == p), path)
+        fragments.setdefault(parent, []).extend(errors_by_path[path])
+
+    # every invalid object in a single call, the original request is sent once
+    keys = {path: f"fragment_{i}" for i, path in enumerate(fragments)}
+    Repair = create_model("Repair", **{keys[path]: (_model_at(schema, path), ...) for path in fragments})
+    fixer = llm.with_structured_output(Repair, method="function_calling")
+    if retry_exceptions:
+        fixer = fixer.with_retry(retry_if_exception_type=retry_exceptions, wait_exponential_jitter=True, stop_after_attempt=6)
+    fixed = await fixer.ainvoke([*_as_messages(messages), HumanMessage(REPAIR_TEMPLATE.format(fragments="\n".join(
+        FRAGMENT_TEMPLATE.format(
+            key=keys[path],
+            errors="\n".join(errors),
+            fragment=json.dumps(_get(payload, path), ensure_ascii=False),
+        )
+        for path, errors in fragments.items()
+    )))])
+    for path, key in keys.items():
+        payload = _set(payload, path, getattr(fixed, key).model_dump())
+    return payload
+
+# ---------------- STRUCTURED EXTRACTION ----------------
+async def aextract_structured(llm, messages, schema: type[BaseModel], max_repairs: int = 2, retry_exceptions: tuple = ()):
+    """
+    Call llm with schema as a forced tool call and return a validated schema instance.
+    If the answer does not validate, only the invalid objects (e.g. one step) are sent back
+    to the model with their errors and the original request, all in one call, at most max_repairs times.
+    retry_exceptions : exceptions (e.g. rate limits) retried with exponential backoff
+    """
+    extractor = llm.with_structured_output(schema, method="function_calling", include_raw=True)
+    if retry_exceptions:
+        extractor = extractor.with_retry(retry_if_exception_type=retry_exceptions, wait_exponential_jitter=True, stop_after_attempt=6)
+
+    result = await extractor.ainvoke(messages)
+    if result.get("parsed") is not None:
+        return result["parsed"]
+
+    payload = _raw_payload(result["raw"])
+    if payload is None:
+        raise ValueError(f"unreadable answer : {result.get('parsing_error')}")
+
+    for attempt in range(max_repairs + 1):
+        try:
+            return schema.model_validate(payload)
+        except ValidationError as e:
+            if attempt == max_repairs:
+                raise
+            print(f"🔧 Réparation de {len(e.errors())} erreur(s) de validation")
+            payload = await _repair(llm, messages, schema, payload, e, retry_exceptions)